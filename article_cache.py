@@ -0,0 +1,54 @@
+"""
+Local store of research articles keyed by PII and DOI in SQLite
+holds trimmed `coredata` of articles fetched from Elsevier and records
+articles that could not be found, with a shorter TTL,
+so that overlapping search terms do not use quota for the same articles
+"""
+
+import os
+from sqlite_store import TTLCache
+
+CACHE_FILE = os.path.join("db", "article_cache.db")
+TTL_DAYS = 30
+NEGATIVE_TTL_DAYS = 1
+# Fields of `coredata` used by `transform_scd`, also requested by `research.get_sciencedirect`
+COREDATA_FIELDS = ["pii", "prism:doi", "dc:title", "dc:description", "dc:creator", "prism:coverDate", "link"]
+
+cache = TTLCache(CACHE_FILE, "articles", TTL_DAYS, NEGATIVE_TTL_DAYS)
+
+
+def _key(pii=None, doi=None):
+    return f"pii:{pii}" if pii else f"doi:{doi.lower()}"
+
+
+def get_article(pii=None, doi=None):
+    """
+    Returns cached article (`{'coredata': ...}`) with given PII or DOI,
+    empty dict if article is known to be missing
+    or None if article is not cached or has expired
+    """
+    if not pii and not doi:
+        return None
+    coredata = cache.get(_key(pii, doi))
+    return {'coredata': coredata} if coredata else coredata
+
+
+def store_article(article, pii=None, doi=None):
+    """ Stores trimmed `coredata` of article under its PII and DOI """
+    coredata = article.get('coredata', {})
+    trimmed = {field: coredata[field] for field in COREDATA_FIELDS if field in coredata}
+    keys = set()
+    for article_pii in [pii, trimmed.get('pii')]:
+        if article_pii:
+            keys.add(_key(pii=article_pii))
+    for article_doi in [doi, trimmed.get('prism:doi')]:
+        if article_doi:
+            keys.add(_key(doi=article_doi))
+    cache.store(keys, trimmed)
+
+
+def store_not_found(status, pii=None, doi=None):
+    """ Records that article could not be found (HTTP `status`) """
+    if not pii and not doi:
+        return
+    cache.store_not_found([_key(pii, doi)], status)
@@ -0,0 +1,297 @@
+"""
+Measurements of performance changes
+
+To compare size and parse time of full and field-projected ScienceDirect articles:
+    python3 benchmarks.py research-payload <search-term> --limit <n>
+
+To compare `standard_date` with parsing every date by dateutil:
+    python3 benchmarks.py dates --repeat <n>
+
+To compare `clean_html` with three `re.sub` passes on descriptions in JSON file of items
+(raw payloads in `original`), or on generated HTML if no file is given:
+    python3 benchmarks.py html [json-file] --repeat <n>
+
+To compare size and peak memory of JSON file of items with raw payloads in `original`
+and with payloads moved to blob store:
+    python3 benchmarks.py blobs <json-file>
+"""
+
+import os
+import re
+import json
+import random
+import argparse
+import tempfile
+import resource
+import requests
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from sys import exit
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark")
+    research_parser = subparsers.add_parser("research-payload", help="Full vs field-projected ScienceDirect articles")
+    research_parser.add_argument("search_term", help="Search term for Scopus")
+    research_parser.add_argument("-l", "--limit", help="Number of articles", type=int, default=10)
+    blobs_parser = subparsers.add_parser("blobs", help="Items with raw payloads vs payloads in blob store")
+    blobs_parser.add_argument("source", help="Path of JSON file of items")
+    dates_parser = subparsers.add_parser("dates", help="standard_date vs dateutil on dates of each upstream format")
+    dates_parser.add_argument("-r", "--repeat", help="Times each date is parsed", type=int, default=1000)
+    html_parser = subparsers.add_parser("html", help="clean_html vs three re.sub passes on descriptions")
+    html_parser.add_argument("source", help="Path of JSON file of items", nargs="?", default=None)
+    html_parser.add_argument("-r", "--repeat", help="Times each description is cleaned", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.benchmark == "research-payload":
+        research_payload(args.search_term, args.limit)
+    elif args.benchmark == "dates":
+        dates(args.repeat)
+    elif args.benchmark == "html":
+        html(args.source, args.repeat)
+    elif args.benchmark == "blobs":
+        blobs(args.source)
+    else:
+        parser.print_help()
+        exit(1)
+
+
+def research_payload(search_term, limit=10):
+    """ Compare bytes and JSON parse time of full and field-projected articles """
+    import research
+
+    search_results = research.search_scopus(search_term, limit)
+    full = {'bytes': 0, 'parse': 0.0}
+    projected = {'bytes': 0, 'parse': 0.0}
+    count = 0
+    for result in search_results:
+        url = "https://api.elsevier.com/content/article/pii/" + result['pii']
+        payload = {"apiKey": research.API_KEY, "httpAccept": "application/json"}
+        try:
+            full_response = requests.get(url, params=payload)
+            full_response.raise_for_status()
+            payload['view'] = research.SCD_VIEW
+            payload['field'] = research.SCD_FIELDS
+            projected_response = requests.get(url, params=payload)
+            projected_response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Skipping {result['pii']}: {e}")
+            continue
+        for totals, response in [(full, full_response), (projected, projected_response)]:
+            totals['bytes'] += len(response.content)
+            start = perf_counter()
+            json.loads(response.content)
+            totals['parse'] += perf_counter() - start
+        count += 1
+
+    if count == 0:
+        print("No articles fetched")
+        return
+    print(f"\nArticles: {count}")
+    print('{:<12s} {:>14s} {:>16s}'.format("", "BYTES/ARTICLE", "PARSE MS/ARTICLE"))
+    for name, totals in [("Full", full), ("Projected", projected)]:
+        print('{:<12s} {:>14.0f} {:>16.3f}'.format(name, totals['bytes'] / count, totals['parse'] * 1000 / count))
+    print('{:<12s} {:>14.0f} {:>16.3f}'.format(
+        "Saved", (full['bytes'] - projected['bytes']) / count, (full['parse'] - projected['parse']) * 1000 / count))
+
+
+# Dates in formats returned by each source
+SAMPLE_DATES = [
+    "2021-03-04T08:00:00Z",             # iTunes
+    "2019-11-20T17:45:12.000Z",         # YouTube
+    "2022-07-01T10:15:00-07:00",
+    "2020-06-15",                       # Spotify, Scopus
+    "2004",                             # Google Books
+    "Tue, 10 Jun 2003 04:00:00 GMT",    # RSS
+    "Wed, 02 Oct 2002 13:00:00 EDT",
+    "Mon, 5 Feb 2018 22:10:00 +0000",
+    "Fri, 31 Dec 2021 23:59:59 PST",
+    "March 3, 2020",                    # Parsed by dateutil
+]
+
+
+def dates(repeat=1000):
+    """ Compare time of `standard_date` (cold and memoized) and dateutil for sample dates """
+    from common import standard_date, _parse_date
+    from dateutil.parser import parse
+
+    # Parsing of `standard_date` before fast paths
+    def dateutil_date(pub_date):
+        if pub_date.isdigit() and len(pub_date) == 4:
+            return pub_date + "-01-01"
+        for zone, offset in [("EDT", "-0400"), ("EST", "-0500"), ("PST", "-0800"), ("PDT", "-0700")]:
+            pub_date = pub_date.replace(zone, offset)
+        return parse(pub_date).strftime("%Y-%m-%d")
+
+    mismatches = [d for d in SAMPLE_DATES if standard_date(d) != dateutil_date(d)]
+    for d in mismatches:
+        print(f"Mismatch for {d}: {standard_date(d)} != {dateutil_date(d)}")
+
+    start = perf_counter()
+    for _ in range(repeat):
+        for d in SAMPLE_DATES:
+            dateutil_date(d)
+    dateutil_time = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(repeat):
+        _parse_date.cache_clear()
+        for d in SAMPLE_DATES:
+            standard_date(d)
+    cold_time = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(repeat):
+        for d in SAMPLE_DATES:
+            standard_date(d)
+    memo_time = perf_counter() - start
+
+    calls = repeat * len(SAMPLE_DATES)
+    print(f"\nDates: {len(SAMPLE_DATES)}   Calls: {calls}   Mismatches: {len(mismatches)}")
+    print('{:<22s} {:>12s} {:>10s}'.format("", "US/CALL", "SPEEDUP"))
+    for name, elapsed in [("dateutil", dateutil_time), ("standard_date", cold_time), ("standard_date memo", memo_time)]:
+        print('{:<22s} {:>12.2f} {:>9.1f}x'.format(name, elapsed * 1e6 / calls, dateutil_time / elapsed))
+
+
+def html(source=None, repeat=10):
+    """ Compare output and time of `clean_html` (cold and memoized) and three `re.sub` passes """
+    import common
+    from html import unescape
+
+    # Cleaning of `clean_html` before single pass
+    def three_pass(raw_html):
+        temp = re.sub(common.RE_EOL_TAG, '\n', raw_html)
+        temp = re.sub(common.RE_SPACE_TAG, " ", temp)
+        temp = re.sub(common.RE_TAG, '', temp)
+        return unescape(temp)
+
+    corpus = _html_corpus(source) if source else _generated_html()
+    if not corpus:
+        print("No descriptions found")
+        return
+    mismatches = 0
+    for text in corpus:
+        common._html_memo.clear()
+        if common.clean_html(text) != three_pass(text):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"Mismatch for {text[:80]!r}")
+
+    start = perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            three_pass(text)
+    three_pass_time = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(repeat):
+        common._html_memo.clear()
+        for text in set(corpus):
+            common.clean_html(text)
+    cold_time = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            common.clean_html(text)
+    memo_time = perf_counter() - start
+
+    calls = repeat * len(corpus)
+    print(f"\nDescriptions: {len(corpus)}   Unique: {len(set(corpus))}   Mismatches: {mismatches}")
+    print('{:<22s} {:>12s} {:>10s}'.format("", "US/CALL", "SPEEDUP"))
+    for name, elapsed, count in [
+            ("three passes", three_pass_time, calls),
+            ("clean_html", cold_time, repeat * len(set(corpus))),
+            ("clean_html memo", memo_time, calls)]:
+        print('{:<22s} {:>12.2f} {:>9.1f}x'.format(name, elapsed * 1e6 / count, (three_pass_time / calls) / (elapsed / count)))
+
+
+def _html_corpus(source):
+    """ Descriptions and summaries found in raw payloads of items in JSON file """
+    from common import load_existing_json_file
+
+    corpus = []
+    def collect(value, key=None):
+        if isinstance(value, dict):
+            for k, v in value.items():
+                collect(v, k)
+        elif isinstance(value, list):
+            for v in value:
+                collect(v, key)
+        elif isinstance(value, str) and key in ["description", "html_description", "summary", "content"]:
+            corpus.append(value)
+
+    for item in load_existing_json_file(None, None, source) or []:
+        collect(item.get('original', []))
+    return corpus
+
+
+def _generated_html(count=2000, seed=1):
+    """ Random descriptions made of text, tags, entities and malformed markup """
+    tokens = ["Episode", " ", "about", "health", "\n", "<p>", "</p>", "<br>", "<br/>", "<br><br>",
+              "&nbsp;", "&amp;", "&#39;", "<a href='https://example.com'>", "</a>", "<b>", "</b>",
+              "<", ">", "<x", "</p", "<img src=\"i.png\"/>", "&"]
+    rng = random.Random(seed)
+    unique = ["".join(rng.choice(tokens) for _ in range(rng.randint(5, 200))) for _ in range(count // 4)]
+    # Same descriptions repeat, as shows do across their episodes
+    return [rng.choice(unique) for _ in range(count)]
+
+
+def blobs(source):
+    """
+    Compare bytes and peak RSS of loading JSON file of items as is and with payloads
+    moved to blob store. Blob store is built in a temporary folder
+    """
+    from common import load_existing_json_file, create_json_file
+    from blob_store import externalize_items
+
+    items = load_existing_json_file(None, None, source)
+    if not items:
+        print("No items found")
+        return
+    originals = sum(len(item.get('original', [])) for item in items)
+
+    with tempfile.TemporaryDirectory() as folder:
+        blob_folder = os.path.join(folder, "blobs")
+        externalize_items(items, blob_folder)
+        create_json_file(folder, "items", items)
+        externalized = os.path.join(folder, "items.json")
+        blob_files = [os.path.join(root, name) for root, _, names in os.walk(blob_folder) for name in names]
+
+        sizes = {
+            "Full": os.path.getsize(source),
+            "Hashes": os.path.getsize(externalized),
+            "Blobs": sum(os.path.getsize(path) for path in blob_files),
+        }
+        # Each file is loaded in a new process so that peak RSS is not shared
+        rss = {
+            "Baseline": _peak_rss(None),
+            "Full": _peak_rss(source),
+            "Hashes": _peak_rss(externalized),
+        }
+
+    print(f"\nItems: {len(items)}   Payloads: {originals}   Unique payloads: {len(blob_files)}")
+    print('{:<12s} {:>14s} {:>16s}'.format("", "BYTES", "PEAK RSS KB"))
+    print('{:<12s} {:>14d} {:>16d}'.format("Full", sizes['Full'], rss['Full'] - rss['Baseline']))
+    print('{:<12s} {:>14d} {:>16d}'.format("Hashes", sizes['Hashes'], rss['Hashes'] - rss['Baseline']))
+    print('{:<12s} {:>14d} {:>16s}'.format("Blob store", sizes['Blobs'], ""))
+    print('{:<12s} {:>14d} {:>16d}'.format(
+        "Saved", sizes['Full'] - sizes['Hashes'] - sizes['Blobs'], rss['Full'] - rss['Hashes']))
+
+
+def _peak_rss(filepath):
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_load_and_measure, filepath).result()
+
+
+def _load_and_measure(filepath):
+    """ Load JSON file and return peak RSS of process in KB """
+    if filepath:
+        with open(filepath, "r") as f:
+            items = json.load(f)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+if __name__=="__main__":
+    main()
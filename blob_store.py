@@ -0,0 +1,95 @@
+"""
+Content-addressed store of raw upstream payloads (`original` of db items)
+Each payload is saved once as gzipped JSON in `db/blobs/<hash[:2]>/<hash>.json.gz`,
+named by SHA-256 of its canonical JSON, and items keep only hashes in `original`
+so that payloads repeated across items (e.g. show of every podcast episode) are stored once
+
+To load JSON file of items with payloads put back in `original`:
+    items = load_items("ki_json/search/podcasts.json")
+"""
+
+import os
+import json
+import gzip
+import hashlib
+import threading
+from functools import lru_cache
+from pathlib import Path
+from common import CustomEncoder, load_existing_json_file
+
+BLOB_FOLDER = os.path.join("db", "blobs")
+
+
+def blob_hash(payload):
+    """ SHA-256 of canonical JSON of payload """
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), cls=CustomEncoder)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest(), canonical
+
+
+def blob_path(digest, folder=BLOB_FOLDER):
+    return os.path.join(folder, digest[:2], digest + ".json.gz")
+
+
+def is_blob_hash(value):
+    return isinstance(value, str) and len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+def put(payload, folder=BLOB_FOLDER):
+    """ Saves payload if not already stored and returns its hash """
+    digest, canonical = blob_hash(payload)
+    filepath = blob_path(digest, folder)
+    if os.path.isfile(filepath):
+        return digest
+    Path(os.path.dirname(filepath)).mkdir(parents=True, exist_ok=True)
+    # Write to unique temporary file so concurrent writers of same payload do not collide
+    temp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+        f.write(canonical)
+    os.replace(temp_path, filepath)
+    return digest
+
+
+def get(digest, folder=BLOB_FOLDER):
+    """ Returns payload with given hash """
+    return json.loads(_read(digest, folder))
+
+
+@lru_cache(maxsize=1024)
+def _read(digest, folder):
+    with gzip.open(blob_path(digest, folder), "rt", encoding="utf-8") as f:
+        return f.read()
+
+
+def externalize(db_item, folder=BLOB_FOLDER):
+    """ Replaces payloads in `original` of item with their hashes """
+    db_item['original'] = [
+        original if is_blob_hash(original) else put(original, folder)
+        for original in db_item.get('original', [])
+    ]
+    return db_item
+
+
+def externalize_items(db_items, folder=BLOB_FOLDER):
+    for db_item in db_items:
+        externalize(db_item, folder)
+    return db_items
+
+
+def rehydrate(db_item, folder=BLOB_FOLDER):
+    """ Replaces hashes in `original` of item with their payloads """
+    db_item['original'] = [
+        get(original, folder) if is_blob_hash(original) else original
+        for original in db_item.get('original', [])
+    ]
+    return db_item
+
+
+def rehydrate_items(db_items, folder=BLOB_FOLDER):
+    for db_item in db_items:
+        rehydrate(db_item, folder)
+    return db_items
+
+
+def load_items(filepath, folder=BLOB_FOLDER):
+    """ Loads JSON file of items and puts payloads back in `original` """
+    return rehydrate_items(load_existing_json_file(None, None, filepath) or [], folder)
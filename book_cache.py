@@ -0,0 +1,32 @@
+"""
+Local store of Google Books volumes keyed by volume ID in SQLite
+holds volumes fetched with `get_googlebooks_volume` and records volumes
+that could not be found, with a shorter TTL,
+so that refreshing existing book items does not download unchanged volumes again
+"""
+
+import os
+from sqlite_store import TTLCache
+
+CACHE_FILE = os.path.join("db", "book_cache.db")
+TTL_DAYS = 30
+NEGATIVE_TTL_DAYS = 1
+
+cache = TTLCache(CACHE_FILE, "volumes", TTL_DAYS, NEGATIVE_TTL_DAYS, key_column="id")
+
+
+def get_volumes(book_ids):
+    """
+    Returns dict of volume ID -> cached volume, or empty dict if volume is known to be missing,
+    volumes that are not cached or have expired are left out
+    """
+    return cache.get_many(book_ids)
+
+
+def store_volume(book_id, volume):
+    cache.store([book_id], volume)
+
+
+def store_not_found(book_id, status):
+    """ Records that volume could not be found (HTTP `status`) """
+    cache.store_not_found([book_id], status)
@@ -4,73 +4,101 @@ import requests
 from urllib import parse
 from dotenv import load_dotenv, find_dotenv
 from transform_for_db import transform_book
+from common import paginate
+import book_cache
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse, parse_qs, urlencode
 
 # Get API key from .env
 load_dotenv(find_dotenv())
 API_KEY = os.getenv('GOOGLEBOOKS_API_KEY')
+MAX_RESULTS = 40
+# Only request fields used by `transform_book`
+VOLUME_FIELDS = (
+    "id,volumeInfo(title,authors,description,imageLinks,previewLink,"
+    "categories,averageRating,ratingsCount,publishedDate)"
+)
+BOOK_FIELDS = f"totalItems,items({VOLUME_FIELDS})"
+BOOKS_MAX_WORKERS = 8
 
 logger = logging.getLogger('book-log')
 
-def get_googlebooks(payload):
+def get_googlebooks(payload, limit=None, keep=None):
     """
     Generator to make request to Google Books API, yields next page of results
+    Next page is prefetched while current page is used, at most `limit` results
+    that pass filter `keep` are yielded
     """
 
     url = "https://www.googleapis.com/books/v1/volumes"
-    startIndex = 0
-    while True:
+
+    def fetch_page(startIndex, size):
+        page_payload = dict(payload, startIndex=startIndex, maxResults=size)
         # Make request
-        payload_str = parse.urlencode(payload, safe=':+')
+        payload_str = parse.urlencode(page_payload, safe=':+')
         try:
             response = requests.get(url, params=payload_str)
             response.raise_for_status()
         except requests.RequestException as e:
             print(f"Unable to search Google Books for {payload['q']}: {e}")
-            logger(f"Unable to search Google Books for {payload['q']}: {e}")
-            break    
+            logger.warning(f"Unable to search Google Books for {payload['q']}: {e}")
+            return [], None
         # Parse response
         data = response.json()
-        results = [item for item in data.get('items', [])]
-        # Yield list of title and url
-        # print(f"{startIndex} for {payload['q']}")
-        yield results
+        results = data.get('items', [])
         # Increment startIndex, stop if startIndex is beyond total results
-        startIndex += payload["maxResults"]
-        if startIndex >= data["totalItems"]: 
-            break
-        payload['startIndex'] = startIndex
+        startIndex += size
+        if not results or startIndex >= data.get("totalItems", 0):
+            return results, None
+        return results, startIndex
+
+    return paginate(fetch_page, limit=limit, page_size=payload.get("maxResults", MAX_RESULTS), keep=keep, cursor=0)
+
+class VolumeError(Exception):
+    """ Raised when volume cannot be fetched, with HTTP status of response if any """
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def has_description(item):
+    return item['volumeInfo'].get('description', "") != ""
 
-def search_googlebooks(search_term, limit=10):
+def search_googlebooks(search_term, limit=10, fields=BOOK_FIELDS):
     """ 
     Searches Google Books for given search term using Google API 
     https://developers.google.com/books/docs/v1/using#auth
     and outputs list of title and url, default count of 10
+    `fields` restricts response to fields used by `transform_book`, pass None for full response
     """
 
     # Construct query
     payload = {
         "q": search_term,
         "key": API_KEY,
-        "maxResults": min(limit, 40),
+        "maxResults": min(limit, MAX_RESULTS),
     }
+    if fields:
+        payload['fields'] = fields
 
     final_results = []
-    books_results = get_googlebooks(payload)
-    for result in books_results:
-        # results.extend(result)
-        for item in result:
-            if item['volumeInfo'].get('description', "") != "":
-                final_results.append(item)
-        if len(final_results) >= limit:
-            books_results.close()
-
-    return final_results[:limit]
+    for result in get_googlebooks(payload, limit=limit, keep=has_description):
+        final_results.extend(result)
+
+    return final_results
     
-def books_search_and_transform(search_term, limit=10):
+def books_search_and_transform(search_term, limit=10, seen=None):
+    """
+    Search Google Books and return transformed results
+    If `seen` (dict of volume ID -> item) is given, volumes already found for other terms
+    of the run are not returned again, search term is added to tags of existing item instead
+    """
     search_results = search_googlebooks(search_term, limit)
     db_items = []
     for result in search_results:
+        if seen is not None and result['id'] in seen:
+            merge_tag(seen[result['id']], search_term)
+            continue
         try:
             item = transform_book(result, search_term)
         except Exception as e:
@@ -78,10 +106,22 @@ def books_search_and_transform(search_term, limit=10):
         else:
             if item:
                 db_items.append(item)
+                if seen is not None:
+                    seen[result['id']] = item
     return db_items[:limit]
 
 
-def get_googlebooks_volume(book_id):
+def merge_tag(db_item, search_term):
+    """ Add search term to tags of item if missing """
+    if not isinstance(search_term, str):
+        return
+    tag = search_term.strip().lower()
+    tags = db_item['metadata'].setdefault('tag', [])
+    if tag not in tags:
+        tags.append(tag)
+
+
+def get_googlebooks_volume(book_id, fields=None):
     if not book_id:
         raise Exception(f"get_googlebooks_volume: Google Books ID not found", book_id)
 
@@ -89,19 +129,57 @@ def get_googlebooks_volume(book_id):
     payload = {
         "key": API_KEY,
     }
+    if fields:
+        payload['fields'] = fields
     # Make request
     payload_str = urlencode(payload, safe=':+')
     try:
         response = requests.get(google_url, params=payload_str)
         response.raise_for_status()
     except requests.RequestException as e:
-        raise Exception(f"Unable to fetch data for Google Books ID {book_id}: {e}")
+        raise VolumeError(f"Unable to fetch data for Google Books ID {book_id}: {e}",
+                          e.response.status_code if e.response is not None else None)
 
 
     data = response.json()
     return data
 
 
+def get_googlebooks_volumes(ids, max_workers=BOOKS_MAX_WORKERS, fields=VOLUME_FIELDS, refresh=False):
+    """
+    Get volumes with given Google Books IDs or preview URLs
+    and return dict of ID -> volume, volumes that are not found are left out
+    Volumes are cached in `book_cache` and only missing or expired volumes
+    (all if `refresh`) are fetched, concurrently. Cache holds volumes with `VOLUME_FIELDS`,
+    volumes with other `fields` are always fetched and not cached
+    """
+    book_ids = [extract_book_id(value) if value and value.startswith("http") else value for value in ids]
+    book_ids = list(dict.fromkeys(book_id for book_id in book_ids if book_id))
+    use_cache = fields == VOLUME_FIELDS
+    volumes = book_cache.get_volumes(book_ids) if use_cache and not refresh else {}
+    missing = [book_id for book_id in book_ids if book_id not in volumes]
+
+    def get_volume(book_id):
+        try:
+            volume = get_googlebooks_volume(book_id, fields)
+        except VolumeError as e:
+            logger.warning(e)
+            # Only remember volumes that do not exist, retry other errors next time
+            if e.status == 404:
+                book_cache.store_not_found(book_id, e.status)
+            return book_id, None
+        if use_cache:
+            book_cache.store_volume(book_id, volume)
+        return book_id, volume
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+            for book_id, volume in executor.map(get_volume, missing):
+                volumes[book_id] = volume
+
+    return {book_id: volumes[book_id] for book_id in book_ids if volumes.get(book_id)}
+
+
 def extract_book_id(url):
     parsed_url = urlparse(url)
     queries = parse_qs(parsed_url.query)
@@ -8,11 +8,47 @@ from pathlib import Path
 import re
 import logging
 import csv
+import time
+import math
+import textwrap
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from collections import OrderedDict
+import hashlib
+import threading
 
 RE_TAG = re.compile('<.*?>')
 RE_SPACE_TAG = re.compile('&nbsp;')
 RE_EOL_TAG = re.compile('</p>|(<br>)+|(<br/>)+')
+# `RE_EOL_TAG`, `RE_SPACE_TAG` and `RE_TAG` in one pattern, a tag ends at end of line
+# or before an end-of-line tag, as when they are replaced one after another
+RE_HTML = re.compile(r'(</p>|(?:<br>)+|(?:<br/>)+)|(&nbsp;)|<[^<>\n]*(?:<(?!/p>|br>|br/>)[^<>\n]*)*>')
+# Replacement by index of group that matched, tags have no group
+HTML_REPLACEMENTS = {1: "\n", 2: " ", None: ""}
+HTML_MEMO_SIZE = 4096
 RE_AND = re.compile('\s+&\s+|\s*and\s|\s*,\s*', flags=re.I)
+RE_HOURS_AGO = re.compile("(\d+) hours ago")
+RE_DAYS_AGO = re.compile("(\d+) days ago")
+RE_ISO_DATE = re.compile(r"^(\d{4})(?:-(\d{2})(?:-(\d{2})(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?)?)?)?$")
+RE_RFC822_DATE = re.compile(r"^(?:[A-Za-z]{3},?\s+)?(\d{1,2})\s+([A-Za-z]{3})\s+(\d{4})(?:\s+\d{1,2}:\d{2}(?::\d{2})?(?:\s+(?:[A-Za-z]{1,5}|[+-]\d{4}))?)?$")
+MONTHS = {month: n for n, month in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start=1)}
+# UTC offsets in seconds of timezone abbreviations used by feeds
+TIMEZONES = {
+    "UT": 0, "UTC": 0, "GMT": 0, "Z": 0,
+    "EST": -5 * 3600, "EDT": -4 * 3600,
+    "CST": -6 * 3600, "CDT": -5 * 3600,
+    "MST": -7 * 3600, "MDT": -6 * 3600,
+    "PST": -8 * 3600, "PDT": -7 * 3600,
+    "AKST": -9 * 3600, "AKDT": -8 * 3600,
+    "HST": -10 * 3600,
+    "BST": 3600, "CET": 3600, "CEST": 2 * 3600,
+    "EET": 2 * 3600, "EEST": 3 * 3600,
+    "IST": 19800, "SGT": 8 * 3600, "JST": 9 * 3600,
+    "AEST": 10 * 3600, "AEDT": 11 * 3600,
+    "NZST": 12 * 3600, "NZDT": 13 * 3600,
+}
 
 LOGGING_FOLDER = "log"
 LOGGING_FILENAME = "common.log"
@@ -26,6 +62,10 @@ logging.basicConfig(
     level=logging.DEBUG)
 logger = logging.getLogger('common')
 
+# Cleaned HTML by hash of text, oldest entries are dropped first
+_html_memo = OrderedDict()
+_html_memo_lock = threading.Lock()
+
 def standard_date(pub_date):
     """ Standardise date format """
     if pub_date:
@@ -34,13 +74,11 @@ def standard_date(pub_date):
             hours = 0
             days = 0
             
-            re_hours = re.compile("(\d+) hours ago")
-            hours_search = re_hours.search(pub_date)
+            hours_search = RE_HOURS_AGO.search(pub_date)
             if hours_search:
                 hours = int(hours_search.group(1))
             
-            re_days = re.compile("(\d+) days ago")
-            days_search = re_days.search(pub_date)
+            days_search = RE_DAYS_AGO.search(pub_date)
             if days_search:
                 days = int(days_search.group(1))
             
@@ -49,26 +87,42 @@ def standard_date(pub_date):
                 return pub_date.strftime("%Y-%m-%d")
             return None
         
-        try:
-            # Date format: YYYY -> YYYY:01:01
-            date = datetime.strptime(pub_date, "%Y")
-            pub_date = date.strftime("%Y-%m-%d")
-        except ValueError:
-            try:
-                # Check for timezones. #TODO: Account for more timezones
-                pub_date = pub_date.replace("EDT", "-0400")
-                pub_date = pub_date.replace("EST", "-0500")
-                pub_date = pub_date.replace("PST", "-0800")
-                pub_date = pub_date.replace("PDT", "-0700")
-                # Parse most known formats
-                date = parse(pub_date)
-                pub_date = date.strftime("%Y-%m-%d")
-            except ValueError:
-                logger.warning("Date Problem")
-                return None
+        return _parse_date(pub_date)
     
     return pub_date
 
+@lru_cache(maxsize=4096)
+def _parse_date(pub_date):
+    """
+    Parse date string to YYYY-MM-DD, known upstream formats are matched directly
+    and other formats are parsed by dateutil. Memoized as same dates repeat across items
+    """
+    # Date format: YYYY -> YYYY-01-01 (Google Books)
+    # or YYYY-MM-DD with optional time and offset (iTunes, YouTube, Spotify, Scopus)
+    match = RE_ISO_DATE.match(pub_date)
+    if match:
+        year, month, day = match.groups()
+        return _valid_date(int(year), int(month or 1), int(day or 1))
+    # Date format: Tue, 10 Jun 2003 04:00:00 GMT (RSS)
+    match = RE_RFC822_DATE.match(pub_date)
+    if match and match.group(2).lower() in MONTHS:
+        day, month, year = match.groups()
+        return _valid_date(int(year), MONTHS[month.lower()], int(day))
+    try:
+        # Parse most known formats, with offsets of common timezone abbreviations
+        date = parse(pub_date, tzinfos=TIMEZONES)
+        return date.strftime("%Y-%m-%d")
+    except (ValueError, OverflowError):
+        logger.warning("Date Problem")
+        return None
+
+def _valid_date(year, month, day):
+    try:
+        return date(year, month, day).strftime("%Y-%m-%d")
+    except ValueError:
+        logger.warning("Date Problem")
+        return None
+
 def standard_duration(audio_length):
     """ Standardise time duration to HH:MM:SS format """
     if not audio_length:
@@ -113,16 +167,31 @@ def clean_html(raw_html):
     Cleans HTML text by replacing with end-of-line, spaces and para tags
     with appropriate alternatives. Removes all other HTML tags `<...>`
     Unescapes remaining text.
+    Same descriptions are cleaned many times (e.g. show of every episode)
+    so results are memoized by hash of text
     """
     if not isinstance(raw_html, str):
         return raw_html
-    
-    temp = re.sub(RE_EOL_TAG, '\n', raw_html)
-    temp = re.sub(RE_SPACE_TAG, " ", temp)
-    temp = re.sub(RE_TAG, '', temp)
-    clean_text = unescape(temp)
+
+    key = hashlib.blake2b(raw_html.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    with _html_memo_lock:
+        if key in _html_memo:
+            _html_memo.move_to_end(key)
+            return _html_memo[key]
+
+    # Replace end-of-line and space tags and remove other tags in one pass
+    temp = RE_HTML.sub(_html_replacement, raw_html)
+    clean_text = unescape(temp) if "&" in temp else temp
+
+    with _html_memo_lock:
+        _html_memo[key] = clean_text
+        if len(_html_memo) > HTML_MEMO_SIZE:
+            _html_memo.popitem(last=False)
     return clean_text
 
+def _html_replacement(match):
+    return HTML_REPLACEMENTS[match.lastindex]
+
 
 def split_by_and(input_string):
     if not isinstance(input_string, str):
@@ -289,4 +358,108 @@ def append_dict_to_csv(filepath, row):
             
     with open(filepath, 'a') as f:
         w = csv.DictWriter(f, headers)
-        w.writerow(row)
\ No newline at end of file
+        w.writerow(row)
+
+
+
+class JsonListWriter:
+    """
+    Context manager that writes items to JSON file as a list one at a time,
+    formatted like `create_json_file`. Items are written to a temporary file
+    which replaces `filepath` only when list is complete
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.count = 0
+        self._file = None
+
+    def __enter__(self):
+        Path(os.path.dirname(self.filepath) or ".").mkdir(parents=True, exist_ok=True)
+        self._file = open(self.filepath + ".tmp", 'w')
+        self._file.write("[")
+        return self
+
+    def write(self, item):
+        json_string = json.dumps(item, indent=4, cls=CustomEncoder)
+        self._file.write(("," if self.count else "") + "\n" + textwrap.indent(json_string, "    "))
+        self.count += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self._file.close()
+            os.remove(self.filepath + ".tmp")
+            return False
+        self._file.write("\n]" if self.count else "]")
+        self._file.close()
+        os.replace(self.filepath + ".tmp", self.filepath)
+        return False
+
+class SharedRateLimiter:
+    """
+    Rate limiter that can be shared by threads and by processes of a pool
+    (pass it to the pool initializer), spaces calls evenly so that at most
+    `max_calls` are made every `period` seconds
+    """
+    def __init__(self, max_calls, period=1):
+        self.interval = period / max_calls
+        self.lock = multiprocessing.Lock()
+        self.next_call = multiprocessing.Value('d', 0.0, lock=False)
+
+    def __enter__(self):
+        with self.lock:
+            now = time.time()
+            wait = self.next_call.value - now
+            self.next_call.value = max(now, self.next_call.value) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def paginate(fetch_page, limit=None, page_size=50, keep=None, cursor=None):
+    """
+    Generator that yields pages of items from `fetch_page(cursor, size)`,
+    which returns list of items and cursor of next page (None if last page).
+    Next page is fetched in the background while current page is consumed.
+    Only items that pass filter `keep` are yielded, and once `limit` items
+    are collected no more pages are fetched. Size of each page is
+    only what is still needed to reach `limit`, allowing for items
+    dropped by `keep` so far.
+    """
+    fetched = 0
+    passed = 0
+    collected = 0
+
+    def next_size():
+        if not limit:
+            return page_size
+        needed = limit - collected
+        # Ask for more than needed when filter drops some of the items
+        if keep and fetched:
+            needed = math.ceil(needed * fetched / passed) if passed else page_size
+        return max(min(page_size, needed), 1)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(fetch_page, cursor, next_size())
+    try:
+        while future:
+            items, cursor = future.result()
+            fetched += len(items)
+            if keep:
+                items = [item for item in items if keep(item)]
+            passed += len(items)
+            if limit:
+                items = items[:limit - collected]
+            collected += len(items)
+            # Prefetch next page before yielding current page
+            future = None
+            if cursor is not None and (not limit or collected < limit):
+                future = executor.submit(fetch_page, cursor, next_size())
+            yield items
+    finally:
+        if future:
+            future.cancel()
+        executor.shutdown(wait=False)
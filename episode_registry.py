@@ -0,0 +1,101 @@
+"""
+Persistent mapping of iTunes episode IDs (`trackId`) to Spotify episode IDs
+stored next to the show registry, records how each match was made
+so that matchers can skip searching and comparing known episodes
+"""
+
+import string
+from difflib import SequenceMatcher
+from common import timestamp_ms
+from show_registry import get_connection, registry_lock
+from sqlite_store import select_in
+
+MATCH_EXACT = "exact"
+MATCH_EPISODE_NUMBER = "episode-number"
+MATCH_FUZZY = "fuzzy"
+MATCH_SEARCH = "search"
+
+_table_created = False
+
+
+def get_episode_connection():
+    """ Get registry connection and create episodes table if needed """
+    global _table_created
+    connection = get_connection()
+    with registry_lock:
+        if not _table_created:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS episodes (
+                    itunes_id INTEGER UNIQUE,
+                    spotify_id TEXT UNIQUE,
+                    method TEXT,
+                    score REAL,
+                    created INTEGER,
+                    updated INTEGER
+                )
+            """)
+            connection.commit()
+            _table_created = True
+    return connection
+
+
+def get_spotify_ids(itunes_ids):
+    """ Returns dict of iTunes episode ID -> Spotify episode ID for confirmed matches (not fuzzy) """
+    itunes_ids = [int(i) for i in itunes_ids if i]
+    return dict(_select_many("itunes_id", "spotify_id", itunes_ids))
+
+
+def get_itunes_ids(spotify_ids):
+    """ Returns dict of Spotify episode ID -> iTunes episode ID for confirmed matches (not fuzzy) """
+    spotify_ids = [i for i in spotify_ids if i]
+    return dict(_select_many("spotify_id", "itunes_id", spotify_ids))
+
+
+def get_spotify_id(itunes_id):
+    return get_spotify_ids([itunes_id]).get(int(itunes_id)) if itunes_id else None
+
+
+def _select_many(key, value, ids):
+    # Fuzzy (date only) matches are not reused, they are made again only when matching with `fuzzy`
+    rows = select_in(
+        get_episode_connection(),
+        f"SELECT {key}, {value} FROM episodes WHERE method IS NOT ? AND {value} IS NOT NULL AND {key} IN ({{}})",
+        ids, [MATCH_FUZZY])
+    return [(row[0], row[1]) for row in rows]
+
+
+def store_match(itunes_id, spotify_id, method, score=None, commit=True):
+    """
+    Records confirmed match of iTunes episode with Spotify episode,
+    replaces earlier matches of either episode
+    """
+    if not itunes_id or not spotify_id:
+        return
+    now = timestamp_ms()
+    with registry_lock:
+        connection = get_episode_connection()
+        connection.execute(
+            "DELETE FROM episodes WHERE itunes_id = ? OR spotify_id = ?",
+            (int(itunes_id), spotify_id))
+        connection.execute("""
+            INSERT INTO episodes (itunes_id, spotify_id, method, score, created, updated)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (int(itunes_id), spotify_id, method, score, now, now))
+        if commit:
+            connection.commit()
+
+
+def store_item_match(db_item, method, score=None):
+    """ Records match using iTunes and Spotify episode IDs of db item """
+    ids = db_item['metadata'].get('id', {})
+    store_match(ids.get('itunes_id'), ids.get('spotify_id'), method, score)
+
+
+def title_score(title, other_title):
+    """ Similarity of two titles ignoring case and punctuation, from 0 to 1 """
+    if not title or not other_title:
+        return 0.0
+    table = str.maketrans('', '', string.punctuation)
+    title = title.casefold().translate(table).strip()
+    other_title = other_title.casefold().translate(table).strip()
+    return round(SequenceMatcher(None, title, other_title).ratio(), 3)
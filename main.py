@@ -1,18 +1,23 @@
 """ 
 Searches for terms in text file passed as an argument
-in Apple Podcasts, Scopus, YouTube, TED talks and Google Books
+in Apple Podcasts, Scopus, PubMed, YouTube, TED talks and Google Books
 saves JSON files for each type in folder `ki_json` 
 default number of results per type is 50
 """
 
 import os
 import argparse
+from functools import partial
 from common import create_json_file, get_search_list
 from podcasts import podcast_eps_search_and_transform
-from research import research_search_and_transform
+from research import research_search_and_transform, get_deferred_search_terms
+from pubmed import pubmed_search_and_transform
 from videos import youtube_search_and_transform
-from tedtalks import ted_youtube_search_and_transform
+from tedtalks import ted_youtube_search_and_transform, ted_video_counts
 from books import books_search_and_transform
+from youtube_quota import print_plan
+from blob_store import externalize_items
+from slug_index import SlugIndex
 from sys import exit
 from progress import progress
 
@@ -24,6 +29,8 @@ def main():
     parser.add_argument("search_file", help="Path of the text file containing search terms")
     parser.add_argument("-l", "--limit", help="Total results", type=int, default=TOTAL_RESULTS)
     parser.add_argument("-f", "--folder", help="Destination folder", type=str, default='ki_json')
+    parser.add_argument("-b", "--blobs", help="Save raw payloads in blob store, items keep only hashes in `original`", action="store_true")
+    parser.add_argument("-p", "--plan-uploads", help="Include listing uploads of TED channels in YouTube quota plan (1 quota unit per channel)", action="store_true")
     args = parser.parse_args()
     
     # Get search terms from text file at `args.search_time`
@@ -33,11 +40,16 @@ def main():
     except Exception as e:
         print(e)
         exit(1)
+
+    # Predict YouTube quota units used by run, listing uploads of TED channels only if asked
+    # as counting videos of channels uses quota
+    print_plan(search_list, args.limit, video_counts=ted_video_counts() if args.plan_uploads else ())
     
     # Dict containing results of each category
     results = {
         'podcasts': [],
         'research': [],
+        'pubmed': [],
         'videos': [],
         'tedtalks': [],
         'books': [],
@@ -46,15 +58,25 @@ def main():
     search_functions = [
         ('podcasts', podcast_eps_search_and_transform),
         ('research', research_search_and_transform),
+        ('pubmed', pubmed_search_and_transform),
         ('videos', youtube_search_and_transform),
         ('tedtalks', ted_youtube_search_and_transform),
-        ('books', books_search_and_transform),
+        # Books found for several terms are kept once with tags merged
+        ('books', partial(books_search_and_transform, seen={})),
     ]
     folder_name = os.path.join(args.folder, os.path.basename(args.search_file).replace(".txt", ""))
+    # Slugs of items saved in earlier runs, except files that are replaced by this run
+    slugs = SlugIndex.from_files(
+        [os.path.join(args.folder, "**", "*.json")],
+        exclude=[os.path.join(folder_name, type + ".json") for type in results])
     # Loop through each function
     for type, fn in search_functions:
+        terms = search_list
+        # Search terms deferred in earlier runs because of Elsevier quota are searched first
+        if type == 'research':
+            terms = list(dict.fromkeys(get_deferred_search_terms() + search_list))
         # Loop through each search term
-        for i, search_term in enumerate(search_list):
+        for i, search_term in enumerate(terms):
             # progress(i+1, total, type)
             # Get results
             try:
@@ -62,10 +84,14 @@ def main():
             except Exception as e:
                 print("FATAL ERROR:", e)
             else:
+                # Move raw payloads out of memory as results come in
+                if args.blobs:
+                    externalize_items(search_results)
                 # Add results to results list
                 print('{:<10s} {:<20s} {:<3s}'.format( type.upper(), search_term, str(len(search_results)) ))
                 results[type].extend(search_results)
-        # Create json file for each category of results
+        # Make slugs unique and create json file for each category of results
+        slugs.assign(results[type])
         create_json_file(
             folder=folder_name, name=type, source_dict=results[type]
         )
@@ -1,13 +1,15 @@
 import os
 import argparse
 import pprint
+import string
+from html import unescape
 from common import create_json_file, load_existing_json_file, valid_existing_file, valid_source_destination
-from podcasts import search_podcasts
+from podcasts import search_podcasts, get_all_episodes, itunes_lookup_podcast
 from progress import progress
 from time import sleep
 from sys import exit
 
-pp = pprint.PrettyPrinter(depth=6)                                               
+pp = pprint.PrettyPrinter(depth=6)
 
 def main():
     # Parse and check arguments
@@ -15,6 +17,7 @@ def main():
     parser.add_argument("source", help="Path to db items")
     parser.add_argument("-v", "--verbose", help="Print results as they come", action="store_true")
     parser.add_argument("-d", "--delay", help="Delay searches because of rate limits", action="store_true")
+    parser.add_argument("-n", "--no-search", help="Only match with show catalog, do not search unmatched episodes", action="store_true")
     args = parser.parse_args()
 
     # Check path and get source file
@@ -36,22 +39,50 @@ def main():
         exit(1)
     if args.verbose: print("Updating iTunes links for", podcast_name, podcast_id)
 
-    # For each podcast_episodes search for corresponding iTunes episode
+    # Get all episodes of show once and index by title,
+    # if paging through search fails use recent episodes from lookup and search for the rest
+    try:
+        _, catalog = get_all_episodes(podcast_id)
+    except Exception as e:
+        print(f"Unable to get all episodes of {podcast_name}, using recent episodes: {e}")
+        catalog = itunes_lookup_podcast(podcast_id)[1:]
+    index = index_episodes(catalog)
+    if args.verbose: print("Episodes in iTunes catalog:", len(catalog))
+
+    # For each podcast_episodes find corresponding iTunes episode in catalog
     count_matched = 0
     count_untouched = 0
+    unmatched = []
     for n, item in enumerate(podcast_episodes):
         episode_title = item["title"]
         links = item['metadata'].setdefault('additional_links', {})
         links.setdefault('spotify_url', None)
-        links.setdefault('itunes_url', None)        
+        links.setdefault('itunes_url', None)
         progress(n, total, episode_title)
 
         # Check if field already exists
         if links.get('itunes_url') and links['itunes_url'] != "":
             count_untouched += 1
             continue
-        
-        # Search Apple iTunes Podcasts
+
+        result = index.get(normalize_title(episode_title))
+        if result:
+            links['itunes_url'] = result['trackViewUrl']
+            count_matched += 1
+        else:
+            unmatched.append(item)
+
+    # Search Apple iTunes Podcasts for episodes missing in catalog
+    can_search = not args.no_search
+    for n, item in enumerate(unmatched):
+        episode_title = item["title"]
+        links = item['metadata']['additional_links']
+        if not can_search:
+            failed.append(item)
+            continue
+        if args.verbose: print("\nSearching iTunes by title:", episode_title)
+        progress(n + 1, len(unmatched), episode_title)
+
         matched = False
         query = episode_title
         while len(query) > 100:
@@ -60,29 +91,30 @@ def main():
             results = search_podcasts(query, attribute="titleTerm")
             if args.delay: sleep(5)
         except Exception as e:
+            # Stop searching but keep matching results so far
             print(e)
+            can_search = False
             failed.append(item)
-            break
-        else:
-            # Find matching result
-            for result in results:
-                # Update `additional_links` and stop loop
-                if result['trackName'] == episode_title and result['collectionId'] == podcast_id:                  
-                    links['itunes_url'] = result['trackViewUrl']
-                    count_matched += 1
-                    matched = True
-                    break
-            if matched: continue
+            continue
+        # Find matching result
+        for result in results:
+            # Update `additional_links` and stop loop
+            if result['trackName'] == episode_title and str(result['collectionId']) == str(podcast_id):
+                links['itunes_url'] = result['trackViewUrl']
+                count_matched += 1
+                matched = True
+                break
+        if matched: continue
         # Note all episodes with no matches
         failed.append(item)
-        if args.verbose: print("No matches found!")  
+        if args.verbose: print("No matches found!")
 
     # Create output files
 
     create_json_file(destination_folder, destination_file, podcast_episodes)
     print(f"\n\niTunes links for {count_matched + count_untouched} out of {total}")
     create_json_file(destination_folder, "failed", failed)
-    create_json_file(destination_folder, "fuzzy_matches", fuzzy)    
+    create_json_file(destination_folder, "fuzzy_matches", fuzzy)
 
 
 
@@ -90,9 +122,32 @@ def find_podcast_id(podcast_episodes):
     for item in podcast_episodes:
         if "collectionId" in item:
             return item['collectionId']
+        itunes_id = item['metadata'].get('podcast_id', {}).get('itunes_id')
+        if itunes_id:
+            return itunes_id
     return None
 
 
+def normalize_title(title):
+    """ Normalize title by unescaping, lowering case, removing punctuation and extra spaces """
+    if not isinstance(title, str):
+        return None
+    title = unescape(title).casefold().translate(str.maketrans('', '', string.punctuation))
+    return " ".join(title.split())
+
+
+def index_episodes(episodes):
+    """ Returns dict of normalized title -> iTunes episode """
+    index = {}
+    for episode in episodes:
+        if episode.get('wrapperType') != "podcastEpisode":
+            continue
+        key = normalize_title(episode.get('trackName'))
+        if key:
+            index.setdefault(key, episode)
+    return index
+
+
 
 if __name__=="__main__":
-    main()
\ No newline at end of file
+    main()
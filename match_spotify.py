@@ -12,8 +12,12 @@ from spotipy.oauth2 import SpotifyClientCredentials
 from urllib.parse import urlparse
 from transform_for_db import transform_spotify, add_itunes_data
 import podcasts
+import episode_registry
 from time import sleep
 from sys import exit
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ratelimiter import RateLimiter
 
 # Get API keys from .env
 load_dotenv(find_dotenv())
@@ -27,6 +31,10 @@ pp = pprint.PrettyPrinter(depth=6)
 RE_EP = re.compile("^\#?\d+|(?:ep|episode|EP|episode)\s?\#?\d+")     
 RE_NO_KEYWORDS = re.compile("\s+\|\s+")      
 SPOTIFY_MARKET = "US"                                            
+SPOTIFY_PAGE_SIZE = 50
+SPOTIFY_MAX_WORKERS = 5
+# Shared by all threads making Spotify requests
+spotify_limiter = RateLimiter(max_calls=10, period=1)
 
 def main():
     # Parse and check arguments
@@ -51,6 +59,14 @@ def main():
     count_updated = 0
     # update_results = []
     failed = []
+
+    # Get Spotify episodes already matched with iTunes episodes
+    itunes_ids = [item['metadata'].get('id', {}).get('itunes_id') for item in podcast_episodes]
+    try:
+        known_episodes = get_known_episodes(itunes_ids)
+    except Exception as e:
+        print(e)
+        known_episodes = {}
     
     # Check each item
     for i, item in enumerate(podcast_episodes):
@@ -60,6 +76,7 @@ def main():
         title = item['title']
         podcast = item['metadata']['podcast_title']
         links = item['metadata'].setdefault('additional_links', {})
+        itunes_id = item['metadata'].get('id', {}).get('itunes_id')
 
         # If field already exists, move to next item
         if links.get('spotify_url') and links['spotify_url'] != "":
@@ -67,13 +84,21 @@ def main():
             if args.verbose: print("No need to update")
             continue
         
-        # Find URL and update
-        try:
-            episode = find_spotify_episode(title, podcast, args.verbose)
-        except Exception:
-            # Stop loop and save results so far
-            failed.append(item) 
-            break
+        # Use known match, else search Spotify for URL
+        episode = known_episodes.get(itunes_id)
+        if episode:
+            if args.verbose: print("Known match:", title)
+        else:
+            try:
+                episode = find_spotify_episode(title, podcast, args.verbose)
+            except Exception:
+                # Stop loop and save results so far
+                failed.append(item) 
+                break
+            if episode:
+                episode_registry.store_match(
+                    itunes_id, episode['id'], episode_registry.MATCH_SEARCH,
+                    episode_registry.title_score(title, episode['name']))
         if episode:
             url = episode['external_urls']['spotify']                  
             links.setdefault('spotify_url', url)
@@ -145,7 +170,8 @@ def matching_episode_ids(title, podcast, verbose=False):
         while len(query) > 100:
             query = query.rsplit(" ", maxsplit=1)[0]
         # Get results
-        results = sp.search(q=query, type="episode", limit=10, offset=0, market=SPOTIFY_MARKET)
+        with spotify_limiter:
+            results = sp.search(q=query, type="episode", limit=10, offset=0, market=SPOTIFY_MARKET)
     except spotipy.SpotifyException as e:
         print(e.msg, e.reason)
         if e.http_status == 429:
@@ -171,7 +197,8 @@ def get_episodes(ids):
     Get episode objects from Spotify for each id
     """
     try:
-        results = sp.episodes(ids, market=SPOTIFY_MARKET)
+        with spotify_limiter:
+            results = sp.episodes(ids, market=SPOTIFY_MARKET)
     except spotipy.SpotifyException as e:
         print(e.msg)
         if e.http_status == 429:
@@ -181,8 +208,34 @@ def get_episodes(ids):
         return results['episodes']
 
 
+def get_known_episodes(itunes_ids):
+    """
+    Returns dict of iTunes episode ID -> Spotify episode object
+    for episodes already matched in episode registry
+    """
+    known_ids = episode_registry.get_spotify_ids(itunes_ids)
+    if not known_ids:
+        return {}
+    itunes_by_spotify = {spotify_id: itunes_id for itunes_id, spotify_id in known_ids.items()}
+    spotify_ids = list(itunes_by_spotify)
+    known_episodes = {}
+    for i in range(0, len(spotify_ids), SPOTIFY_PAGE_SIZE):
+        for episode in get_episodes(spotify_ids[i:i + SPOTIFY_PAGE_SIZE]):
+            if episode:
+                known_episodes[itunes_by_spotify[episode['id']]] = episode
+    return known_episodes
+
+
 def match_title(title, podcast, spotify_title):
     """ Match episode titles accounting for subtle differences """
+    return title_match_method(title, podcast, spotify_title) is not None
+
+
+def title_match_method(title, podcast, spotify_title):
+    """ 
+    Match episode titles accounting for subtle differences,
+    returns how titles were matched or None if they do not match
+    """
 
     # Normalize by lowering case and removing punctuation
     title = title.strip().casefold()
@@ -194,23 +247,23 @@ def match_title(title, podcast, spotify_title):
     
     # 1. Spotify title is the same as item title
     if title == spotify_title:
-        return True
+        return episode_registry.MATCH_EXACT
     # 2. Spotify title includes both title of epsiode and name of podcast
     elif title in spotify_title and podcast in spotify_title:
-        return True
+        return episode_registry.MATCH_EXACT
     
     # Remove episode numbers from titles
     spotify_title_no_ep = re.sub(RE_EP, "", spotify_title).strip()
     title_no_ep = re.sub(RE_EP, "", title).strip()
     # 3. After removing episode number, Spotify title is the same as item title
     if title == spotify_title_no_ep:
-        return True
+        return episode_registry.MATCH_EPISODE_NUMBER
     # 4. After removing episode number, Spotify title includes both title of epsiode and name of podcast 
     elif title_no_ep in spotify_title_no_ep and podcast in spotify_title_no_ep:
-        return True
+        return episode_registry.MATCH_EPISODE_NUMBER
 
 
-    return False
+    return None
 
 
 def match_podcast(podcast, spotify_podcast, publisher=None):
@@ -257,7 +310,8 @@ def search_show(podcast_name, verbose=False):
         query = podcast_name
         while len(query) > 100:
             query = query.rsplit(" ", maxsplit=1)[0]
-        results = sp.search(q=query, type="show", limit=10, offset=0, market=SPOTIFY_MARKET)
+        with spotify_limiter:
+            results = sp.search(q=query, type="show", limit=10, offset=0, market=SPOTIFY_MARKET)
     except spotipy.SpotifyException as e:
         print(e.msg, e.reason)
         if e.http_status == 429:
@@ -270,8 +324,8 @@ def find_spotify_show(name, verbose=False):
     try:
         results = search_show(name)
     except Exception as e:
-        exit(1)
-            
+        raise Exception(f"find_spotify_show: Unable to search Spotify for {name}: {e}")
+
     for item in results:
         if match_podcast(name, item['name'], item['publisher']):
             if verbose: print("✔️ ", item['name'])
@@ -281,21 +335,80 @@ def find_spotify_show(name, verbose=False):
 
     return None
 
-def get_show_episodes(show_id, verbose=False):
-    offset = 0
-    while True: 
-        try:
-            results = sp.show_episodes(show_id=show_id, limit=50, offset=offset, market=SPOTIFY_MARKET)
-        except spotipy.SpotifyException as e:
-            print(e.msg, e.reason)
-            if e.http_status == 429:
-                exit(1)
-            break
-        yield results['items']
-
-        offset += 50
-        if offset >= results['total']:
-            break
+def get_show_episodes(show_id, verbose=False, since=None, max_workers=SPOTIFY_MAX_WORKERS):
+    """
+    Generator that yields pages of episodes of show with ID `show_id`, newest first.
+    First page gives `total`, remaining pages are fetched concurrently
+    and yielded in order.
+    If `since` (YYYY-MM-DD) is given, stops paging once episodes
+    released before that date are reached
+    """
+    since = str(since) if since else None
+    try:
+        results = get_show_episodes_page(show_id, offset=0)
+    except spotipy.SpotifyException as e:
+        print(e.msg, e.reason)
+        if e.http_status == 429:
+            raise Exception(f"get_show_episodes: Spotify rate limit exceeded for show {show_id}")
+        return
+    items, reached_since = episodes_since(results['items'], since)
+    yield items
+    if reached_since:
+        return
+
+    # Keep `max_workers` pages in flight ahead of the page being yielded
+    offsets = iter(range(SPOTIFY_PAGE_SIZE, results['total'], SPOTIFY_PAGE_SIZE))
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    try:
+        for offset in offsets:
+            pending.append(executor.submit(get_show_episodes_page, show_id, offset))
+            if len(pending) >= max_workers:
+                break
+        while pending:
+            try:
+                results = pending.popleft().result()
+            except spotipy.SpotifyException as e:
+                print(e.msg, e.reason)
+                if e.http_status == 429:
+                    raise Exception(f"get_show_episodes: Spotify rate limit exceeded for show {show_id}")
+                break
+            items, reached_since = episodes_since(results['items'], since)
+            yield items
+            if reached_since:
+                break
+            offset = next(offsets, None)
+            if offset is not None:
+                pending.append(executor.submit(get_show_episodes_page, show_id, offset))
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def get_show_episodes_page(show_id, offset=0):
+    """ Get a single page of episodes of show with ID `show_id` """
+    with spotify_limiter:
+        return sp.show_episodes(show_id=show_id, limit=SPOTIFY_PAGE_SIZE, offset=offset, market=SPOTIFY_MARKET)
+
+
+def episodes_since(items, since=None):
+    """
+    Returns episodes in `items` released on or after `since`
+    and whether an older episode was found
+    """
+    if not since:
+        return items, False
+    recent = []
+    for episode in items:
+        if not episode:
+            continue
+        # Release date can be as coarse as a year, compare only that precision
+        release_date = episode.get('release_date') or ""
+        if release_date and release_date < since[:len(release_date)]:
+            return recent, True
+        recent.append(episode)
+    return recent, False
 
 
 def save_all_episodes_podcast_and_transform(url, podcast_name, folder="ki_json", verbose=False, fetch_itunes=True):
@@ -321,7 +434,8 @@ def save_all_episodes_podcast_and_transform(url, podcast_name, folder="ki_json",
     spotify_id = split_path[1]
 
     try:
-        spotify_show = sp.show(spotify_id, market=SPOTIFY_MARKET)
+        with spotify_limiter:
+            spotify_show = sp.show(spotify_id, market=SPOTIFY_MARKET)
         podcast_name = spotify_show['name']
         print(podcast_name)
     except spotipy.SpotifyException as e:
@@ -351,22 +465,41 @@ def save_all_episodes_podcast_and_transform(url, podcast_name, folder="ki_json",
             itunes_episodes = podcasts.itunes_lookup_podcast(itunes_id)
             show = next((item for item in itunes_episodes if item["kind"] == "podcast"), {})
             metadata = podcasts.scrape_itunes_metadata(itunes_id, show)
+            # iTunes episodes already matched with Spotify episodes
+            itunes_by_id = {
+                itunes['trackId']: itunes for itunes in itunes_episodes 
+                if itunes["wrapperType"] == "podcastEpisode"
+                }
+            known_ids = episode_registry.get_itunes_ids(
+                [item['metadata']['id']['spotify_id'] for item in episodes])
+            count_matched = 0
 
             for i, item in enumerate(episodes):
                 # progress(i + 1, total)
                 episode_title = item["title"]
-                count_matched = 0
+                spotify_episode_id = item['metadata']['id']['spotify_id']
+                matched = False
                 if verbose: print(episode_title)
                 item['metadata']['podcast_id']['itunes_id'] = itunes_id
 
+                # Use known match
+                known = itunes_by_id.get(known_ids.get(spotify_episode_id))
+                if known:
+                    item = add_itunes_data(item, known, metadata)
+                    count_matched += 1
+                    continue
                 
                 for itunes in itunes_episodes:
                     if itunes["wrapperType"] != "podcastEpisode":
                         continue
 
                     try:
-                        if match_title(episode_title, podcast_name, itunes['trackName']):
+                        method = title_match_method(episode_title, podcast_name, itunes['trackName'])
+                        if method:
                             item = add_itunes_data(item, itunes, metadata)            
+                            episode_registry.store_match(
+                                itunes['trackId'], spotify_episode_id, method,
+                                episode_registry.title_score(episode_title, itunes['trackName']))
                             matched = True
                             count_matched += 1
                             if verbose: print(f"\n{episode_title} -> {itunes['trackName']}")
@@ -374,6 +507,9 @@ def save_all_episodes_podcast_and_transform(url, podcast_name, folder="ki_json",
                             
                         elif item["publishedDate"] == standard_date(itunes["releaseDate"]):
                             item = add_itunes_data(item, itunes, metadata) 
+                            episode_registry.store_match(
+                                itunes['trackId'], spotify_episode_id, episode_registry.MATCH_FUZZY,
+                                episode_registry.title_score(episode_title, itunes['trackName']))
                             matched = True
                             fuzzy.append(item)
                             count_matched += 1
@@ -402,6 +538,9 @@ def save_all_episodes_podcast_and_transform(url, podcast_name, folder="ki_json",
                             # Update `additional_links` and stop loop
                             if result['collectionId'] == itunes_id:                  
                                 item = add_itunes_data(item, result, metadata) 
+                                episode_registry.store_match(
+                                    result['trackId'], spotify_episode_id, episode_registry.MATCH_SEARCH,
+                                    episode_registry.title_score(episode_title, result['trackName']))
                                 count_matched += 1
                                 matched = True
                                 break
@@ -1,15 +1,17 @@
 import os
-import csv
+import glob
 import argparse
 import spotipy
-from common import create_json_file, load_existing_json_file, valid_source_destination, get_search_list
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from common import create_json_file, load_existing_json_file, valid_source_destination, get_search_list, SharedRateLimiter
 from dotenv import load_dotenv, find_dotenv
-from match_spotify import match_title, search_show, match_podcast, get_show_episodes
+from match_spotify import title_match_method, search_show, match_podcast, get_show_episodes
 from transform_for_db import add_spotify_data
 from progress import progress
 from spotipy.oauth2 import SpotifyClientCredentials
-
-shows_file = os.path.join("db", "spotify_show_ids.csv")
+import match_spotify
+import show_registry
+import episode_registry
 
 # Get API key from .env
 load_dotenv(find_dotenv())
@@ -17,12 +19,17 @@ SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
 SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
 sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=SPOTIFY_CLIENT_ID,
                                                            client_secret=SPOTIFY_CLIENT_SECRET))
+BATCH_WORKERS = 4
+# Spotify calls per second shared by all workers in batch mode
+BATCH_CALLS_PER_SECOND = 10
 
 def main():
     # Parse and check arguments
     parser = argparse.ArgumentParser()
     parser.add_argument("--txt", help="Path to file containing search terms", type=str)
     parser.add_argument("--source", help="Path to db items", type=str)
+    parser.add_argument("--batch", help="Folder or glob pattern of JSON files of db items, one podcast per file", type=str)
+    parser.add_argument("-w", "--workers", help="Number of shows updated in parallel", type=int, default=BATCH_WORKERS)
     parser.add_argument("-v", "--verbose", help="Print results as they come", action="store_true")
     parser.add_argument("-f", "--fuzzy", help="Match episodes whose date match but titles do not match", action="store_true")
     args = parser.parse_args()
@@ -34,108 +41,247 @@ def main():
             find_and_store_show_id(name)
         exit(0)
 
-    elif not args.source:
+    elif not args.source and not args.batch:
         print("Pass either text file containing podcast names with '-txt'", 
-            "or JSON file of a single podcast to be updated with '-source'")
+            "or JSON file of a single podcast to be updated with '-source'",
+            "or folder of JSON files of podcasts to be updated with '-batch'")
         exit(1)
 
+    # If running to update JSON files of many podcasts in a folder or matching a glob pattern
+    if args.batch:
+        sources = batch_sources(args.batch)
+        if not sources:
+            print(f"No JSON files found for {args.batch}")
+            exit(1)
+        summary = update_shows(sources, fuzzy=args.fuzzy, verbose=args.verbose, workers=args.workers)
+        print_summary(summary)
+        exit(0)
+
     # If running to update a JSON file containing db items of a single podcast to be updated
     
     # Check path and get source file
     destination_folder = os.path.join(os.path.dirname(args.source), "updated")
     if not valid_source_destination(args.source, destination_folder, file_ext=".json"):
         exit(1)
-    destination_file = os.path.basename(args.source)
-    destination = os.path.join(destination_folder, destination_file)
-    podcast_episodes = load_existing_json_file(None, None, args.source)
-    total = len(podcast_episodes)
+    result = update_show_file(args.source, fuzzy=args.fuzzy, verbose=args.verbose)
+    if result['error']:
+        print(result['error'])
+        exit(1)
+
+
+def update_show_file(source, fuzzy=False, verbose=False, batch=False):
+    """
+    Updates db items of a single podcast in JSON file `source` with Spotify data,
+    saves updated items, failed and fuzzy matches in folder `updated`
+    If `batch`, output files are prefixed with name of source file 
+    and progress is not shown.
+    Returns summary of results
+    """
+    destination_folder = os.path.join(os.path.dirname(source), "updated")
+    destination_file = os.path.basename(source)
+    prefix = destination_file.replace(".json", "") + "_" if batch else ""
+    podcast_episodes = load_existing_json_file(None, None, source)
+    total = len(podcast_episodes) if podcast_episodes else 0
     failed = []
-    fuzzy = []
+    fuzzy_matches = []
+    summary = {
+        'source': source,
+        'podcast': None,
+        'total': total,
+        'matched': 0,
+        'untouched': 0,
+        'failed': 0,
+        'fuzzy': 0,
+        'error': None,
+    }
+    if total == 0:
+        summary['error'] = f"No db items in {source}"
+        return summary
     
     # Get podcast name
     podcast_name = podcast_episodes[0]['metadata']['podcast_title']
-    if args.verbose: print("Updating Spotify links for", podcast_name)
+    summary['podcast'] = podcast_name
+    if verbose: print("Updating Spotify links for", podcast_name)
     
     # Check if Spotify ID already stored for name
-    with open(shows_file) as csvfile:
-        reader = csv.DictReader(csvfile)
-        spotify_id = next((row['id'] for row in reader if row['name'] == podcast_name), None)
+    show = show_registry.get_show(podcast_name)
+    spotify_id = show['spotify_id'] if show else None
     # Else search for Spotify ID
     if not spotify_id:
-        spotify_id = find_and_store_show_id(podcast_name, args.verbose)
-        # Quit if not found
+        spotify_id = find_and_store_show_id(podcast_name, verbose)
+        # Stop if not found
         if not spotify_id:
-            print("Could not load Spotify ID")
-            exit(1)
+            summary['error'] = f"Could not load Spotify ID for {podcast_name}"
+            return summary
 
     # Get all episodes of show with id `spotify_id`
-    if args.verbose: print(spotify_id)
+    if verbose: print(spotify_id)
     spotify_episodes = []
-    episodes = get_show_episodes(spotify_id, args.verbose)
-    for episode_set in episodes:
-        spotify_episodes.extend(episode_set)
-    create_json_file("test", "spotify_eps", spotify_episodes)
+    try:
+        for episode_set in get_show_episodes(spotify_id, verbose):
+            spotify_episodes.extend(episode_set)
+    except Exception as e:
+        summary['error'] = f"Could not load Spotify episodes for {podcast_name}: {e}"
+        return summary
+    if not batch:
+        create_json_file("test", "spotify_eps", spotify_episodes)
+
+    # Spotify episodes already matched with podcast_episodes
+    spotify_by_id = {episode['id']: episode for episode in spotify_episodes if episode}
+    known_ids = episode_registry.get_spotify_ids(
+        [item['metadata'].get('id', {}).get('itunes_id') for item in podcast_episodes])
 
     # Match podcast_episodes with spotify_episodes
     count_matched = 0
     count_untouched = 0
     for n, item in enumerate(podcast_episodes):
         episode_title = item["title"]
+        itunes_id = item['metadata'].get('id', {}).get('itunes_id')
         links = item['metadata'].setdefault('additional_links', {})
         links.setdefault('spotify_url', None)
-        progress(n, total, episode_title)
+        if not batch: progress(n, total, episode_title)
 
         # Check if field already exists
         if links.get('spotify_url') and links['spotify_url'] != "":
             count_untouched += 1
-            print("No need to update")
+            if verbose: print("No need to update")
+            continue
+
+        # Use known match
+        known = spotify_by_id.get(known_ids.get(itunes_id))
+        if known:
+            item = add_spotify_data(item, known)
+            count_matched += 1
             continue
 
         # Check with each episode in spotify_episodes
         matched = False
-        for episode in spotify_episodes:
+        for episode in spotify_by_id.values():
             
-            if match_title(episode_title, podcast_name, episode['name']):
+            method = title_match_method(episode_title, podcast_name, episode['name'])
+            if method:
                 # Update spotify link                
                 item = add_spotify_data(item, episode) 
+                episode_registry.store_match(
+                    itunes_id, episode['id'], method,
+                    episode_registry.title_score(episode_title, episode['name']))
                 matched = True
                 count_matched += 1
-                if args.verbose: print(f"\n{episode_title} -> {episode['name']}")
+                if verbose: print(f"\n{episode_title} -> {episode['name']}")
                 break
             
-            elif args.fuzzy and item["publishedDate"] == episode["release_date"]:
+            elif fuzzy and item["publishedDate"] == episode["release_date"]:
                 item = add_spotify_data(item, episode) 
-                fuzzy.append(item)
+                episode_registry.store_match(
+                    itunes_id, episode['id'], episode_registry.MATCH_FUZZY,
+                    episode_registry.title_score(episode_title, episode['name']))
+                fuzzy_matches.append(item)
                 matched = True
                 count_matched += 1
-                if args.verbose: print(f"\n{episode_title} -> {episode['name']}")
-                if args.verbose: print("Matched by date not title")
+                if verbose: print(f"\n{episode_title} -> {episode['name']}")
+                if verbose: print("Matched by date not title")
                 break
         
         if not matched:
             failed.append(item)
-            if args.verbose: print("No matches found!")  
+            if verbose: print("No matches found!")  
 
     if count_matched > 0:
         create_json_file(destination_folder, destination_file, podcast_episodes)
-        print(f"\n\nSpotify links for {count_matched + count_untouched} out of {total}")
-    create_json_file(destination_folder, "failed", failed)
-    create_json_file(destination_folder, "fuzzy_matches", fuzzy)
+        if not batch: print(f"\n\nSpotify links for {count_matched + count_untouched} out of {total}")
+    create_json_file(destination_folder, prefix + "failed", failed)
+    create_json_file(destination_folder, prefix + "fuzzy_matches", fuzzy_matches)
+
+    summary['matched'] = count_matched
+    summary['untouched'] = count_untouched
+    summary['failed'] = len(failed)
+    summary['fuzzy'] = len(fuzzy_matches)
+    return summary
+
+
+
+
+def batch_sources(pattern):
+    """ Returns sorted list of JSON files in folder or matching glob pattern """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.json")
+    return sorted(path for path in glob.glob(pattern) if path.endswith(".json"))
+
+
+def update_shows(sources, fuzzy=False, verbose=False, workers=BATCH_WORKERS):
+    """
+    Updates JSON files of many podcasts with Spotify data using a pool of processes
+    sharing one rate limit, each process refreshes its own access token,
+    returns list of summaries of each file
+    """
+    limiter = SharedRateLimiter(max_calls=BATCH_CALLS_PER_SECOND, period=1)
+
+    summary = []
+    with ProcessPoolExecutor(
+            max_workers=workers, 
+            initializer=init_worker, 
+            initargs=(limiter,)
+            ) as executor:
+        futures = {
+            executor.submit(update_show_file, source, fuzzy, verbose, True): source 
+            for source in sources
+            }
+        for i, future in enumerate(as_completed(futures)):
+            source = futures[future]
+            try:
+                result = future.result()
+            except BaseException as e:
+                result = {'source': source, 'podcast': None, 'total': 0, 'matched': 0, 
+                          'untouched': 0, 'failed': 0, 'fuzzy': 0, 'error': f"{e.__class__.__name__} {e}"}
+            summary.append(result)
+            progress(i + 1, len(sources), os.path.basename(source))
+    
+    summary.sort(key=lambda result: result['source'])
+    return summary
+
+
+def init_worker(limiter):
+    """ Use own client, which refreshes its access token when it expires, and shared rate limit in worker process """
+    match_spotify.sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=SPOTIFY_CLIENT_ID,
+                                                                             client_secret=SPOTIFY_CLIENT_SECRET))
+    match_spotify.spotify_limiter = limiter
+
+
+def print_summary(summary):
+    """ Print results of each file and totals, and save summary in folder `updated` """
+    print()
+    print('{:<40s} {:>6s} {:>8s} {:>9s} {:>6s} {:>6s}'.format("PODCAST", "TOTAL", "MATCHED", "UNTOUCHED", "FAILED", "FUZZY"))
+    for result in summary:
+        name = result['podcast'] or os.path.basename(result['source'])
+        if result['error']:
+            print('{:<40.40s} {}'.format(name, result['error']))
+            continue
+        print('{:<40.40s} {:>6d} {:>8d} {:>9d} {:>6d} {:>6d}'.format(
+            name, result['total'], result['matched'], result['untouched'], result['failed'], result['fuzzy']))
+    totals = {key: sum(result[key] for result in summary) for key in ['total', 'matched', 'untouched', 'failed', 'fuzzy']}
+    print('{:<40s} {:>6d} {:>8d} {:>9d} {:>6d} {:>6d}'.format(
+        "ALL", totals['total'], totals['matched'], totals['untouched'], totals['failed'], totals['fuzzy']))
+    errors = len([result for result in summary if result['error']])
+    if errors > 0:
+        print(f"Failed to update {errors} out of {len(summary)} files")
+
+    folder = os.path.join(os.path.dirname(summary[0]['source']), "updated")
+    create_json_file(folder, "summary", summary)
 
 
 def find_and_store_show_id(name, verbose=False):
+    """ Search Spotify for show and store its ID, returns ID or None if not found """
     try:
         results = search_show(name)
     except Exception as e:
-        exit(1)
+        print(f"Unable to search Spotify for {name}: {e}")
+        return None
             
     for item in results:
         if match_podcast(name, item['name'], item['publisher']):
             if verbose:
                 print("✔️ ", item['name'])
-            with open(shows_file, 'a') as f:
-                w = csv.DictWriter(f, {'name', 'id'})
-                w.writerow({'name': name, 'id': item['id']})
+            show_registry.store_show(name, spotify_id=item['id'])
             return item['id']
         elif verbose:
             print("X ", item['name'])
@@ -7,6 +7,8 @@ from common import create_json_file, load_existing_json_file
 from transform_for_db import transform_rss_item, transform_itunes, transform_spotify, add_spotify_data, scrape_itunes_metadata, add_itunes_data
 from urllib.parse import urlparse
 import match_spotify
+import show_registry
+import episode_registry
 from progress import progress
 from ratelimiter import RateLimiter
 
@@ -184,6 +186,14 @@ def podcast_eps_search_and_transform(search_term, limit=10):
     db_items = []
     n = 0
     total = len(search_results)
+
+    # Spotify episodes already matched with search results
+    try:
+        known_episodes = match_spotify.get_known_episodes(
+            [result.get('trackId') for result in search_results])
+    except Exception as e:
+        logger.warning(f"Spotify: Failed fetching known episodes: {e}")
+        known_episodes = {}
     
     # 2. For each result transform into database dict
     for i, result in enumerate(search_results):
@@ -191,22 +201,29 @@ def podcast_eps_search_and_transform(search_term, limit=10):
             
         podcast_id = result['collectionId']
         itunes_results = itunes_lookup_podcast(podcast_id, limit=1)
+        show = {}
         if itunes_results:
             show = next((item for item in itunes_results if item["kind"] == "podcast"), {})
         metadata = scrape_itunes_metadata(podcast_id, show) 
         item = transform_itunes(result, metadata, search_term=result['tag'])
         
         if item:
-            # 3. Search in Spotify and add URL
-            try:
-                spotify_episode = match_spotify.find_spotify_episode(
-                    title=item['title'], podcast=item['metadata']['podcast_title']
-                    )
-            except Exception as e:
-                pass
-            else:
-                if spotify_episode:
-                    item = add_spotify_data(item, spotify_episode)
+            # 3. Use known match or search in Spotify and add URL
+            spotify_episode = known_episodes.get(result.get('trackId'))
+            if not spotify_episode:
+                try:
+                    spotify_episode = match_spotify.find_spotify_episode(
+                        title=item['title'], podcast=item['metadata']['podcast_title']
+                        )
+                except Exception as e:
+                    pass
+                else:
+                    if spotify_episode:
+                        episode_registry.store_match(
+                            result['trackId'], spotify_episode['id'], episode_registry.MATCH_SEARCH,
+                            episode_registry.title_score(item['title'], spotify_episode['name']))
+            if spotify_episode:
+                item = add_spotify_data(item, spotify_episode)
             
             # 4. Collect transformed item
             db_items.append(item)      
@@ -267,19 +284,20 @@ def itunes_lookup_podcast(podcast_id, limit=200, sort="recent", offset=0):
     return data['results']
 
 
-def get_all_episodes_and_transform(show_id):
-    """ Fetch all episodes of given podcast and transform"""
-    
+def get_all_episodes(show_id):
+    """
+    Fetch all episodes of given podcast,
+    returns show info and list of episodes
+    """
+
     # Get recent 200 episodes of podcast with given id using iTunes Lookup API
     results = itunes_lookup_podcast(show_id)
     if not results:
-        return None
+        return None, []
 
-    # Get metadata
     show = results.pop(0) #first result has show info
     podcast_name = show['collectionName']
     track_count = show['trackCount']
-    metadata = scrape_itunes_metadata(show_id, show)     
 
     # If podcast has more than 200 episodes, get episodes using iTunes Search API 
     if track_count > 200:
@@ -302,6 +320,19 @@ def get_all_episodes_and_transform(show_id):
                 # else:
                 #     print(item['collectionId'], "did not match show ID", show_id)
 
+    return show, results
+
+
+def get_all_episodes_and_transform(show_id):
+    """ Fetch all episodes of given podcast and transform"""
+    
+    show, results = get_all_episodes(show_id)
+    if not show:
+        return None
+
+    # Get metadata
+    metadata = scrape_itunes_metadata(show_id, show)     
+
     # Transform results
     episodes = []
     for item in results:
@@ -354,9 +385,13 @@ def save_all_episodes_podcast_and_transform(query, folder="ki_json", verbose=Fal
         return None
     podcast_name = episodes[0]['metadata']['podcast_title']
 
-    # Find Spotify show
-    spotify_show = match_spotify.find_spotify_show(podcast_name, verbose)
-    spotify_show_id = spotify_show.get('id')
+    # Find Spotify show ID in registry, else search Spotify and store
+    show = show_registry.get_show(podcast_name, itunes_id=podcast_id)
+    spotify_show_id = show['spotify_id'] if show else None
+    if not spotify_show_id:
+        spotify_show = match_spotify.find_spotify_show(podcast_name, verbose)
+        spotify_show_id = spotify_show.get('id') if spotify_show else None
+    show_registry.store_show(podcast_name, itunes_id=podcast_id, spotify_id=spotify_show_id)
     if spotify_show_id:
         spotify_episodes = []
         fuzzy = []
@@ -366,20 +401,32 @@ def save_all_episodes_podcast_and_transform(query, folder="ki_json", verbose=Fal
         for batch in spotify_results:
             spotify_episodes.extend(batch)
         # Make dict of unmatched episodes
-        spotify_unmatched = {spot['id']: spot for spot in spotify_episodes}
+        spotify_unmatched = {spot['id']: spot for spot in spotify_episodes if spot}
+        known_ids = episode_registry.get_spotify_ids(
+            [item['metadata']['id']['itunes_id'] for item in episodes])
 
         # Match every iTunes episode with unmatched episodes from Spotify
         for item in episodes:
             episode_title = item["title"]
+            itunes_id = item['metadata']['id']['itunes_id']
             matched = False
             item['metadata']['podcast_id']['spotify_id'] = spotify_show_id
+
+            # Use known match
+            spot_id = known_ids.get(itunes_id)
+            if spot_id in spotify_unmatched:
+                item = add_spotify_data(item, spotify_unmatched.pop(spot_id), podcast_id=spotify_show_id)
+                continue
             
             for spot_id in spotify_unmatched: 
                 spot = spotify_unmatched[spot_id]
                 spot_name = spot['name']
 
-                if match_spotify.match_title(episode_title, podcast_name, spot_name):
+                method = match_spotify.title_match_method(episode_title, podcast_name, spot_name)
+                if method:
                     item = add_spotify_data(item, spot, podcast_id=spotify_show_id) 
+                    episode_registry.store_match(
+                        itunes_id, spot_id, method, episode_registry.title_score(episode_title, spot_name))
                     matched = True
                     if verbose: print(f"\n{episode_title} -> {spot_name}")
                     break
@@ -403,6 +450,9 @@ def save_all_episodes_podcast_and_transform(query, folder="ki_json", verbose=Fal
                         
                     if item["publishedDate"] == spot["release_date"]:
                         item = add_spotify_data(item, spot, podcast_id=spotify_show_id) 
+                        episode_registry.store_match(
+                            item['metadata']['id']['itunes_id'], spot_id, episode_registry.MATCH_FUZZY,
+                            episode_registry.title_score(episode_title, spot_name))
                         fuzzy.append(item)
                         matched = True
                         if verbose: print(f"\n{episode_title} -> {spot_name}")
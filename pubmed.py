@@ -0,0 +1,114 @@
+import os
+import logging
+import requests
+import xmltodict
+from dotenv import load_dotenv, find_dotenv
+from ratelimiter import RateLimiter
+from transform_for_db import transform_pubmed
+from progress import progress
+
+# Get API key from .env, base URL can point to a local stand-in of E-utilities
+load_dotenv(find_dotenv())
+API_KEY = os.getenv('NCBI_API_KEY')
+PUBMED_BASE_URL = os.getenv('PUBMED_BASE_URL') or "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+EFETCH_BATCH = 200
+
+# E-utilities allow 3 requests per second, 10 with API key
+pubmed_limiter = RateLimiter(max_calls=10 if API_KEY else 3, period=1)
+
+logger = logging.getLogger('pubmed-log')
+
+
+def pubmed_search_and_transform(search_term, limit=10):
+    """
+    Search PubMed and return transformed results
+    """
+    try:
+        webenv, query_key, total = esearch(search_term)
+    except Exception as e:
+        logger.warning(f"Unable to search PubMed for {search_term}: {e}")
+        return []
+
+    db_items = []
+    retstart = 0
+    while len(db_items) < limit and retstart < total:
+        # Articles without abstracts are skipped, so ask for more than needed
+        retmax = min(EFETCH_BATCH, (limit - len(db_items)) * 2)
+        try:
+            efetch(webenv, query_key, retstart, retmax,
+                   lambda data: _collect(data, search_term, db_items, limit))
+        except Exception as e:
+            logger.warning(f"Unable to fetch PubMed articles for {search_term}: {e}")
+            break
+        retstart += retmax
+        progress(min(len(db_items), limit), limit)
+
+    return db_items[:limit]
+
+
+def _collect(data, search_term, db_items, limit):
+    """ Transform article and collect it, returns False once `limit` is reached """
+    item = transform_pubmed(data, search_term)
+    if item:
+        db_items.append(item)
+    return len(db_items) < limit
+
+
+def esearch(search_term):
+    """
+    Searches PubMed using ESearch and stores results on History server,
+    returns `WebEnv`, `query_key` and total count of results
+    https://www.ncbi.nlm.nih.gov/books/NBK25499/#chapter4.ESearch
+    """
+    payload = {
+        "db": "pubmed",
+        "term": search_term,
+        "usehistory": "y",
+        "retmax": 0,
+        "sort": "relevance",
+        "retmode": "json",
+    }
+    if API_KEY:
+        payload['api_key'] = API_KEY
+    with pubmed_limiter:
+        response = requests.get(PUBMED_BASE_URL + "esearch.fcgi", params=payload)
+    response.raise_for_status()
+    data = response.json()['esearchresult']
+    return data['webenv'], data['querykey'], int(data['count'])
+
+
+def efetch(webenv, query_key, retstart, retmax, callback):
+    """
+    Fetches batch of articles from History server using EFetch
+    https://www.ncbi.nlm.nih.gov/books/NBK25499/#chapter4.EFetch
+    XML response is parsed as it streams in and `callback` is called
+    for each article (wrapped in `PubmedArticleSet` as expected by `transform_pubmed`),
+    parsing stops when `callback` returns False
+    """
+    payload = {
+        "db": "pubmed",
+        "WebEnv": webenv,
+        "query_key": query_key,
+        "retstart": retstart,
+        "retmax": retmax,
+        "retmode": "xml",
+    }
+    if API_KEY:
+        payload['api_key'] = API_KEY
+    with pubmed_limiter:
+        response = requests.get(PUBMED_BASE_URL + "efetch.fcgi", params=payload, stream=True)
+    response.raise_for_status()
+    response.raw.decode_content = True
+
+    def item_callback(path, item):
+        tag = path[-1][0]
+        if tag != "PubmedArticle" or not isinstance(item, dict):
+            return True
+        return callback({'PubmedArticleSet': {'PubmedArticle': item}})
+
+    try:
+        xmltodict.parse(response.raw, item_depth=2, item_callback=item_callback)
+    except xmltodict.ParsingInterrupted:
+        pass
+    finally:
+        response.close()
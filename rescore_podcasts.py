@@ -0,0 +1,167 @@
+"""
+Recalculates scores of stored podcast items with `calculate_score_podcast` rules,
+as part of score depends on age of `publishedDate` and goes stale.
+Scoring inputs of all items are loaded into arrays and scored at once,
+only items whose score changed are written back
+
+To rescore JSON file of items (saved in `updated` folder next to source):
+    python3 rescore_podcasts.py --source <file-path>
+To rescore podcast items in MongoDB collection set in .env:
+    python3 rescore_podcasts.py --mongo
+"""
+
+import os
+import argparse
+import datetime
+import numpy as np
+import pymongo
+from pymongo import UpdateOne
+from pathlib import Path
+from sys import exit
+from dotenv import load_dotenv, find_dotenv
+from common import create_json_file, load_existing_json_file, valid_existing_file, valid_source_destination
+from transform_for_db import calculate_score_podcast
+
+load_dotenv(find_dotenv())
+MONGO_COLLECTION = "knowledgeitem_master"
+BATCH_SIZE = 1000
+# Fields of stored items used by `calculate_score_podcast`
+SCORE_FIELDS = {
+    "metadata.rating": 1,
+    "metadata.rating_count": 1,
+    "metadata.total_episodes": 1,
+    "publishedDate": 1,
+    "score": 1,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--source", help="Path to JSON file of db items", type=str, default=None)
+    parser.add_argument("-m", "--mongo", help="Rescore podcast items in MongoDB", action="store_true")
+    parser.add_argument("-c", "--check", help="Compare every score with `calculate_score_podcast`", action="store_true")
+    args = parser.parse_args()
+
+    if args.source:
+        destination_folder = os.path.join(os.path.dirname(args.source), "updated")
+        destination = os.path.join(destination_folder, os.path.basename(args.source))
+        Path(destination_folder).mkdir(parents=True, exist_ok=True)
+        if not valid_existing_file(args.source, ".json") or not valid_source_destination(args.source, destination, file_ext=".json"):
+            exit(1)
+        summary = rescore_file(args.source, destination, check=args.check)
+    elif args.mongo:
+        summary = rescore_mongo(check=args.check)
+    else:
+        parser.print_help()
+        exit(1)
+    print(f"Rescored {summary['scored']} of {summary['total']} podcast items, {summary['changed']} changed")
+
+
+def load_columns(items):
+    """
+    Load scoring inputs of items into arrays, `valid` is False for items
+    that `calculate_score_podcast` cannot score (missing numbers or date)
+    """
+    total = len(items)
+    rating = np.zeros(total)
+    rating_count = np.zeros(total)
+    total_episodes = np.zeros(total)
+    published = np.zeros(total, dtype=np.int64)
+    score = np.zeros(total, dtype=np.int64)
+    valid = np.zeros(total, dtype=bool)
+    ordinals = {}
+    for i, item in enumerate(items):
+        metadata = item.get('metadata') or {}
+        values = [metadata.get('rating'), metadata.get('rating_count'), metadata.get('total_episodes')]
+        if not all(isinstance(value, (int, float)) for value in values):
+            continue
+        pub_date = item.get('publishedDate')
+        if pub_date not in ordinals:
+            try:
+                ordinals[pub_date] = datetime.datetime.strptime(pub_date, "%Y-%m-%d").toordinal()
+            except (TypeError, ValueError):
+                ordinals[pub_date] = None
+        if ordinals[pub_date] is None:
+            continue
+        rating[i], rating_count[i], total_episodes[i] = values
+        published[i] = ordinals[pub_date]
+        score[i] = item.get('score') or 0
+        valid[i] = True
+    return {
+        'rating': rating,
+        'rating_count': rating_count,
+        'total_episodes': total_episodes,
+        'published': published,
+        'score': score,
+        'valid': valid,
+    }
+
+
+def calculate_scores(columns, today=None):
+    """ Scores of all items, same rules as `calculate_score_podcast` """
+    today = today or datetime.date.today()
+    rating = columns['rating']
+    rating_count = columns['rating_count']
+    total_episodes = columns['total_episodes']
+
+    # Rating above 3.5 scores by rating band plus 1 for each of 500, 1000 and 2000 ratings
+    count_points = (rating_count >= 500).astype(np.int64) + (rating_count >= 1000) + (rating_count >= 2000)
+    rating_points = (rating > 4.0).astype(np.int64) + (rating > 4.5)
+    scores = np.where(rating > 3.5, rating_points + count_points, 0)
+
+    # Total episodes
+    scores += (total_episodes > 100).astype(np.int64) + (total_episodes > 300) + (total_episodes > 500)
+
+    # Days since publication
+    days_since_pub = today.toordinal() - columns['published']
+    scores -= (days_since_pub > 180).astype(np.int64) + (days_since_pub > 365) + (days_since_pub > 730)
+    return scores
+
+
+def rescore_items(items, check=False):
+    """ Returns new scores, mask of items that could be scored and mask of items whose score changed """
+    columns = load_columns(items)
+    scores = calculate_scores(columns)
+    if check:
+        check_scores(items, columns['valid'], scores)
+    changed = columns['valid'] & (scores != columns['score'])
+    return scores, columns['valid'], changed
+
+
+def check_scores(items, valid, scores):
+    """ Raise exception if any score differs from `calculate_score_podcast` """
+    for i in np.flatnonzero(valid):
+        item = items[i]
+        expected = calculate_score_podcast({'metadata': item['metadata'], 'publishedDate': item['publishedDate']})
+        if expected != scores[i]:
+            raise Exception(f"check_scores: Score {scores[i]} of item {i} should be {expected}")
+
+
+def rescore_file(source, destination, check=False):
+    items = load_existing_json_file(None, None, source) or []
+    podcasts = [item for item in items if item.get('tags') == "podcast"]
+    scores, valid, changed = rescore_items(podcasts, check)
+    for i in np.flatnonzero(changed):
+        podcasts[i]['score'] = int(scores[i])
+    create_json_file(os.path.dirname(destination), os.path.basename(destination), items)
+    return {'total': len(podcasts), 'scored': int(valid.sum()), 'changed': int(changed.sum())}
+
+
+def rescore_mongo(check=False, batch_size=BATCH_SIZE):
+    client = pymongo.MongoClient(os.getenv('MONGO_HOST'), port=int(os.getenv('MONGO_PORT')))
+    collection = client[os.getenv('MONGO_DB')][MONGO_COLLECTION]
+    podcasts = list(collection.find({'tags': "podcast"}, SCORE_FIELDS))
+    scores, valid, changed = rescore_items(podcasts, check)
+
+    # Write back changed scores only, in batches
+    updates = [
+        UpdateOne({'_id': podcasts[i]['_id']}, {'$set': {'score': int(scores[i])}})
+        for i in np.flatnonzero(changed)
+    ]
+    for i in range(0, len(updates), batch_size):
+        collection.bulk_write(updates[i:i + batch_size], ordered=False)
+    return {'total': len(podcasts), 'scored': int(valid.sum()), 'changed': len(updates)}
+
+
+if __name__=="__main__":
+    main()
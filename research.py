@@ -4,105 +4,328 @@ import requests
 from urllib import parse
 from dotenv import load_dotenv, find_dotenv
 from transform_for_db import transform_scopus, transform_scd
-from sys import exit
+import article_cache
 from progress import progress
+from common import paginate
+from ratelimiter import RateLimiter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import threading
+import time
 import pprint
 
 # Get API key from .env
 load_dotenv(find_dotenv())
 API_KEY = os.getenv('SCOPUS_API_KEY')
+# Article retrieval is throttled by Elsevier at 10 requests per second
+ELSEVIER_MAX_WORKERS = 8
+elsevier_limiter = RateLimiter(max_calls=10, period=1)
+# Only request fields used by `transform_scopus` and `transform_scd`
+SCOPUS_FIELDS = "dc:identifier,pii,dc:title,dc:creator,prism:coverDate,link"
+SCOPUS_COUNT = 25
+SCD_VIEW = "META_ABS"
+SCD_FIELDS = ",".join(article_cache.COREDATA_FIELDS)
+# Search results of `COMPLETE` view include abstracts, if allowed for API key
+SCOPUS_COMPLETE_FIELDS = SCOPUS_FIELDS + ",dc:description,author"
+SCOPUS_COMPLETE_VIEW = os.getenv('SCOPUS_COMPLETE_VIEW', "").strip().lower() in ["1", "true", "yes"]
+
+# Search terms deferred because quota was exhausted, searched first in next run
+QUEUE_FILE = os.path.join("db", "research_queue.txt")
+# Longest delay between requests used to spread remaining quota until reset
+MAX_PACING_DELAY = 2
 
 logger = logging.getLogger('research-log')
 pp = pprint.PrettyPrinter(depth=6)  
 
-def get_scopus(payload):
+
+class QuotaExceeded(Exception):
+    """ Elsevier API quota is exhausted until reset """
+
+
+class ElsevierQuota:
+    """
+    Tracks remaining Elsevier API calls from `X-RateLimit-Remaining` and
+    `X-RateLimit-Reset` headers of responses, paces requests when remaining
+    calls would run out before a near reset and stops requests when exhausted
+    """
+    def __init__(self):
+        self.remaining = None
+        self.reset = None
+        self.lock = threading.Lock()
+
+    def update(self, response):
+        """ Read quota headers of response """
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        with self.lock:
+            try:
+                if remaining is not None:
+                    self.remaining = int(remaining)
+                if reset is not None:
+                    self.reset = float(reset)
+            except ValueError:
+                pass
+            # Quota error without headers
+            if response.status_code == 429 and "QUOTA_EXCEEDED" in response.headers.get('X-ELS-Status', ""):
+                self.remaining = 0
+
+    def exhausted(self):
+        with self.lock:
+            if self.remaining is None or self.remaining > 0:
+                return False
+            # Quota is available again after reset
+            if self.reset and self.reset <= time.time():
+                self.remaining = None
+                return False
+            return True
+
+    def wait(self):
+        """ Raise `QuotaExceeded` if exhausted, else wait to spread remaining calls until reset """
+        if self.exhausted():
+            raise QuotaExceeded(f"Elsevier API quota exceeded until {self.reset_time()}")
+        with self.lock:
+            if not self.remaining or not self.reset:
+                return
+            delay = (self.reset - time.time()) / self.remaining
+        if 0 < delay <= MAX_PACING_DELAY:
+            time.sleep(delay)
+
+    def reset_time(self):
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.reset)) if self.reset else "unknown"
+
+
+elsevier_quota = ElsevierQuota()
+
+
+def elsevier_get(url, params, retries=3):
+    """
+    GET request to Elsevier API within rate limit and remaining quota,
+    requests throttled for being too frequent are retried,
+    raises `QuotaExceeded` if quota is exhausted
+    """
+    for attempt in range(retries + 1):
+        elsevier_quota.wait()
+        with elsevier_limiter:
+            response = requests.get(url, params=params)
+        elsevier_quota.update(response)
+        if response.status_code != 429:
+            break
+        if elsevier_quota.exhausted():
+            raise QuotaExceeded(f"Elsevier API quota exceeded until {elsevier_quota.reset_time()}")
+        time.sleep(2 ** attempt)
+    return response
+
+
+def defer_search_term(search_term):
+    """ Add search term to queue file to be searched in next run, unless already queued """
+    if search_term.strip() in get_deferred_search_terms():
+        return
+    Path(os.path.dirname(QUEUE_FILE)).mkdir(parents=True, exist_ok=True)
+    with open(QUEUE_FILE, "a") as f:
+        f.write(search_term.strip() + "\n")
+
+
+def get_deferred_search_terms():
+    """ Returns search terms deferred in earlier runs, terms stay queued until they are searched """
+    if not os.path.isfile(QUEUE_FILE):
+        return []
+    with open(QUEUE_FILE, "r") as f:
+        search_terms = [line.strip() for line in f.readlines() if line.strip() != ""]
+    # Remove duplicates, keep order
+    return list(dict.fromkeys(search_terms))
+
+
+def remove_deferred_search_term(search_term):
+    """ Remove search term from queue file once it has been searched """
+    search_terms = get_deferred_search_terms()
+    if search_term.strip() not in search_terms:
+        return
+    search_terms.remove(search_term.strip())
+    if not search_terms:
+        os.remove(QUEUE_FILE)
+        return
+    temp_path = QUEUE_FILE + ".tmp"
+    with open(temp_path, "w") as f:
+        f.writelines(term + "\n" for term in search_terms)
+    os.replace(temp_path, QUEUE_FILE)
+
+def get_scopus(payload, limit=None, keep=None):
     """
     Generator to make request to Scopus API, yields next page of results
+    Next page is prefetched while current page is used, at most `limit` results
+    that pass filter `keep` are yielded
     """
 
     url = "https://api.elsevier.com/content/search/scopus"
-    startIndex = 0
-    while True:
+
+    def fetch_page(startIndex, size):
+        page_payload = dict(payload, start=str(startIndex), count=size)
         # Make request
         try:
-            response = requests.get(url, params=payload)
+            response = elsevier_get(url, params=page_payload)
             response.raise_for_status()
         except requests.RequestException as e:
-            # Exit application if quota exceeded
-            if response.status_code == 429:
+            status = e.response.status_code if e.response is not None else None
+            # Stop searching if quota exceeded, requests still throttled after retries fail like other errors
+            if status == 429 and elsevier_quota.exhausted():
                 print("Quota exceeded")
                 logger.warning("Quota exceeded")
-                exit(1)
+                raise QuotaExceeded("Elsevier API quota exceeded")
+            # View is not allowed for API key
+            if status in [401, 403] and payload.get('view'):
+                raise Exception(f"Scopus view {payload['view']} not allowed: {e}")
             logger.warning(f"Unable to search Scopus for {payload['query']}: {e}")
-            break  
+            return [], None
         # Parse response
         data = response.json()
-
-        entries = data['search-results']['entry']
-        results = [item for item in entries]
-        # Yield list of title and url
-        yield results
+        results = data['search-results'].get('entry', [])
         # Increment startIndex, stop if startIndex is beyond total results
         startIndex += int(data['search-results']['opensearch:itemsPerPage'])
-        if startIndex >= int(data['search-results']['opensearch:totalResults']): 
-            break
-        payload['start'] = str(startIndex)
+        if not results or startIndex >= int(data['search-results']['opensearch:totalResults']):
+            return results, None
+        return results, startIndex
+
+    return paginate(fetch_page, limit=limit, page_size=int(payload.get('count', SCOPUS_COUNT)), keep=keep, cursor=0)
 
 
-def search_scopus(search_term, limit=10):
+def has_pii(item):
+    return 'pii' in item
+
+
+def search_scopus(search_term, limit=10, count=SCOPUS_COUNT, fields=SCOPUS_FIELDS, view=None):
     """ 
     Searches Scopus for given search term using Scopus Search API
     https://dev.elsevier.com/documentation/ScopusSearchAPI.wadl
     and outputs list of title and url, default count of 10
+    `count` is number of results per page, `fields` restricts fields of each result
+    and `view` is `STANDARD` (default) or `COMPLETE`
     """
     # Construct request URL
     payload = {
         "query": f"TITLE-ABS-KEY({search_term})",
         "apiKey": API_KEY,
         "httpAccept": "application/json",        
+        "count": count,
     }
+    if fields:
+        payload['field'] = fields
+    if view:
+        payload['view'] = view
 
     results = []
-    scopus_results = get_scopus(payload)
-    for i, result in enumerate(scopus_results):
-        progress(i+1, limit)
-        results.extend([item for item in result if 'pii' in item])
-        
-        if len(results) >= limit:
-            scopus_results.close()
+    for result in get_scopus(payload, limit=limit, keep=has_pii):
+        results.extend(result)
+        progress(len(results), limit)
 
-    return results[:limit]
+    return results
 
 
-def research_search_and_transform(search_term, limit=10):
+def research_search_and_transform(search_term, limit=10, abstracts_in_search=SCOPUS_COMPLETE_VIEW):
     """
     Search Scopus and return transformed results
+    If `abstracts_in_search`, uses abstracts in search results (`COMPLETE` view)
+    and only fetches articles without abstracts from ScienceDirect
+    If Elsevier API quota is exhausted, search term is deferred to next run,
+    deferred search term is removed from queue once searched
     """
-    search_results = search_scopus(search_term, limit)
-    
-    total = len(search_results)
-    db_items = []
-    
+    try:
+        if abstracts_in_search:
+            db_items = research_abstracts_search_and_transform(search_term, limit)
+        else:
+            search_results = search_scopus(search_term, limit)
+            db_items = [item for item in fetch_and_transform(search_results, search_term) if item]
+    except QuotaExceeded as e:
+        print(f"{e}: deferring '{search_term}' to next run")
+        logger.warning(f"{e}: deferring '{search_term}' to next run")
+        defer_search_term(search_term)
+        return []
+    remove_deferred_search_term(search_term)
+    return db_items[:limit]
+
+
+def research_abstracts_search_and_transform(search_term, limit=10):
+    """
+    Search Scopus with abstracts and transform search results,
+    articles missing abstracts are fetched from ScienceDirect
+    """
+    try:
+        search_results = search_scopus(
+            search_term, limit, fields=SCOPUS_COMPLETE_FIELDS, view="COMPLETE")
+    except QuotaExceeded:
+        raise
+    except Exception as e:
+        logger.warning(f"Falling back to fetching each article: {e}")
+        search_results = search_scopus(search_term, limit)
+        return [item for item in fetch_and_transform(search_results, search_term) if item]
+
+    # Transformed items in order of Scopus results
+    ranked_items = [None] * len(search_results)
+    missing = {}
     for i, result in enumerate(search_results):
-        progress(i+1, total)
+        if result.get('dc:description'):
+            ranked_items[i] = transform_scopus(result, search_term)
+        else:
+            missing[i] = result
 
-        pii = result['pii']
-        article = get_sciencedirect(pii)
-        if not article:
-            continue
-        item = transform_scd(article, search_term)
-        if not item:
-            continue
-        db_items.append(item)
+    if missing:
+        fetched = fetch_and_transform(list(missing.values()), search_term)
+        for i, item in zip(missing, fetched):
+            ranked_items[i] = item
 
+    db_items = [item for item in ranked_items if item]
     return db_items[:limit]
 
 
+def fetch_and_transform(search_results, search_term):
+    """
+    Fetch articles of Scopus search results from ScienceDirect concurrently
+    and transform each as it arrives, articles in local cache are not fetched
+    returns transformed items (or None) in order of `search_results`
+    """
+    total = len(search_results)
+    ranked_items = [None] * total
+
+    # Use cached articles and skip articles known to be missing
+    to_fetch = {}
+    for i, result in enumerate(search_results):
+        article = article_cache.get_article(pii=result['pii'])
+        if article is None:
+            to_fetch[i] = result['pii']
+        elif article:
+            ranked_items[i] = transform_scd(article, search_term)
+    total = len(to_fetch)
+
+    with ThreadPoolExecutor(max_workers=ELSEVIER_MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(get_sciencedirect, pii): i 
+            for i, pii in to_fetch.items()
+            }
+        for n, future in enumerate(as_completed(futures)):
+            progress(n+1, total)
+            try:
+                article = future.result()
+            except QuotaExceeded:
+                # Do not start remaining requests
+                for pending in futures:
+                    pending.cancel()
+                raise
+            if not article:
+                continue
+            ranked_items[futures[future]] = transform_scd(article, search_term)
+
+    return ranked_items
+
+
 def get_abstract(doi):
     """ 
     Get and return abstract from Elsevier API for given article with DOI if available
     """
 
+    # Check local cache
+    article = article_cache.get_article(doi=doi)
+    if article is not None:
+        return article.get('coredata', {}).get('dc:description')
+
     # Make request
     payload = {
         "apiKey": API_KEY,
@@ -112,14 +335,17 @@ def get_abstract(doi):
     url = f"https://api.elsevier.com/content/article/doi/{doi}"
     payload_str = parse.urlencode(payload, safe='/.')
     try:
-        response = requests.get(url, params=payload_str)
+        response = elsevier_get(url, params=payload_str)
         response.raise_for_status()
     except requests.RequestException as e:
-        # Exit application if quota exceeded
-        if response.status_code == 429:
+        status = e.response.status_code if e.response is not None else None
+        # Stop if quota exceeded
+        if status == 429 and elsevier_quota.exhausted():
             print("QUOTA EXCEEDED")
             logger.warning("Quota exceeded")
-            exit(1)
+            raise QuotaExceeded("Elsevier API quota exceeded")
+        if status in [400, 404]:
+            article_cache.store_not_found(status, doi=doi)
         # print(f"Unable to search abstract for Scopus ID: {doi}: {e}")
         logger.warning(f"Unable to search abstract for Scopus ID: {doi}: {e}")
         return None
@@ -128,6 +354,7 @@ def get_abstract(doi):
     data = response.json()
     try:
         abstract = data['full-text-retrieval-response']['coredata']['dc:description']
+        article_cache.store_article(data['full-text-retrieval-response'], doi=doi)
     except KeyError as e:
         # print(f"Did not receive abstract for: {doi}: {e}")
         logger.warning(f"Did not receive abstract for: {doi}: {e}")
@@ -135,7 +362,13 @@ def get_abstract(doi):
     else:
         return abstract    
 
-def get_sciencedirect(pii):
+def get_sciencedirect(pii, fields=SCD_FIELDS, view=SCD_VIEW):
+    """
+    Get article with given PII using Article Retrieval API
+    https://dev.elsevier.com/documentation/ArticleRetrievalAPI.wadl
+    Only `fields` of `coredata` in `view` are requested, pass None for full response
+    Articles with default fields and articles not found are stored in local cache
+    """
 
     # Construct request URL
     API_url = "https://api.elsevier.com/content/article/pii/" + pii
@@ -143,19 +376,26 @@ def get_sciencedirect(pii):
         "apiKey": API_KEY,
         "httpAccept": "application/json",        
     }
+    if view:
+        payload['view'] = view
+    if fields:
+        payload['field'] = fields
     # Get response
     try:
-        response = requests.get(API_url, params=payload)
+        response = elsevier_get(API_url, params=payload)
         response.raise_for_status()
     # Handle errors
     except requests.RequestException as e:
-        if response.status_code == 429:
-            raise Exception("Elsevier API Quota exceeded")
-        elif response.status_code == 400:
+        status = e.response.status_code if e.response is not None else None
+        if status == 429 and elsevier_quota.exhausted():
+            raise QuotaExceeded("Elsevier API Quota exceeded")
+        elif status == 400:
             print(f"Invalid PII/publication ID {pii}")
+            article_cache.store_not_found(status, pii=pii)
             return None
-        elif response.status_code == 404:
+        elif status == 404:
             print(f"Resource not found for {pii}")
+            article_cache.store_not_found(status, pii=pii)
             return None
         else:
             print(f"Unable to fetch article {pii}: {e}")
@@ -167,4 +407,6 @@ def get_sciencedirect(pii):
         print(f"Unable to parse article {pii}")
         return None
     
+    if fields == SCD_FIELDS:
+        article_cache.store_article(data['full-text-retrieval-response'], pii=pii)
     return data['full-text-retrieval-response']
\ No newline at end of file
@@ -1,5 +1,6 @@
 import os
 import argparse
+from functools import partial
 import pymongo
 import pprint
 from pymongo.errors import BulkWriteError
@@ -8,10 +9,13 @@ from dotenv import load_dotenv, find_dotenv
 from common import create_json_file, get_search_list
 from progress import progress
 from books import books_search_and_transform
+from youtube_quota import print_plan
+from blob_store import externalize_items
+from slug_index import SlugIndex
 from podcasts import podcast_eps_search_and_transform
-from tedtalks import ted_youtube_search_and_transform
+from tedtalks import ted_youtube_search_and_transform, ted_video_counts
 from videos import youtube_search_and_transform
-from research import research_search_and_transform
+from research import research_search_and_transform, get_deferred_search_terms
 from time import sleep
 
 load_dotenv(find_dotenv())
@@ -27,7 +31,7 @@ collection = db['knowledgeitem_master']
 
 TOTAL_RESULTS = 100
 
-def search_various_sources(search_list, limit=TOTAL_RESULTS):
+def search_various_sources(search_list, limit=TOTAL_RESULTS, blobs=False):
     
     # Dict containing results of each category
     results = {
@@ -43,16 +47,23 @@ def search_various_sources(search_list, limit=TOTAL_RESULTS):
         ('research', research_search_and_transform),
         ('videos', youtube_search_and_transform),
         ('tedtalks', ted_youtube_search_and_transform),
-        ('books', books_search_and_transform),
+        # Books found for several terms are kept once with tags merged
+        ('books', partial(books_search_and_transform, seen={})),
     ]
-    total = len(search_list)
     # Loop through each function
     for type, fn in search_functions:
+        terms = search_list
+        # Search terms deferred in earlier runs because of Elsevier quota are searched first
+        if type == 'research':
+            terms = list(dict.fromkeys(get_deferred_search_terms() + search_list))
         # Loop through each search term
-        for i, search_term in enumerate(search_list):
-            progress(i+1, total, type)
+        for i, search_term in enumerate(terms):
+            progress(i+1, len(terms), type)
             # Get results
             search_results = fn(search_term, limit)
+            # Move raw payloads out of memory as results come in
+            if search_results and blobs:
+                externalize_items(search_results)
             # Add results to results list
             if search_results:
                 results[type].extend(search_results[:limit])
@@ -64,6 +75,8 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("search_file", help="Path of the text file containing search terms")
     parser.add_argument("-l", "--limit", help="Total results", type=int, default=TOTAL_RESULTS)
+    parser.add_argument("-b", "--blobs", help="Save raw payloads in blob store, items keep only hashes in `original`", action="store_true")
+    parser.add_argument("-p", "--plan-uploads", help="Include listing uploads of TED channels in YouTube quota plan (1 quota unit per channel)", action="store_true")
     args = parser.parse_args()
     
     # Get search terms from text file at `args.search_time`
@@ -72,15 +85,22 @@ def main():
     except Exception as e:
         exit(e)
 
-    results = search_various_sources(search_list=search_list, limit=args.limit)
+    # Predict YouTube quota units used by run, listing uploads of TED channels only if asked
+    # as counting videos of channels uses quota
+    print_plan(search_list, args.limit, video_counts=ted_video_counts() if args.plan_uploads else ())
+
+    results = search_various_sources(search_list=search_list, limit=args.limit, blobs=args.blobs)
     
     print("Inserting in MongoDB")
+    # Slugs are made unique against all items in collection, loaded once
+    slugs = SlugIndex.from_mongo(collection)
     for type in results:
         # for item in results[type]:
         #     pp.pprint(item)
         #     ir = collection.insert_one(item)
         if len(results[type]) < 1:
             continue            
+        slugs.assign(results[type])
         try:
             ir = collection.insert_many(results[type])
         except BulkWriteError as bwe:
@@ -0,0 +1,148 @@
+"""
+Registry of podcast shows across platforms stored in SQLite
+maps normalized podcast name to iTunes `collectionId`, Spotify show ID
+and Google Podcasts feed ID
+
+To import show IDs stored in CSV file (columns `name`, `id`):
+    python3 show_registry.py --import-csv db/spotify_show_ids.csv
+"""
+
+import os
+import csv
+import string
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+from sys import exit
+from common import timestamp_ms, valid_existing_file
+
+REGISTRY_FILE = os.path.join("db", "show_registry.db")
+SHOWS_CSV_FILE = os.path.join("db", "spotify_show_ids.csv")
+
+_connection = None
+registry_lock = threading.RLock()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--import-csv", help="Path to CSV file of podcast names and Spotify IDs", type=str, default=None)
+    parser.add_argument("-n", "--name", help="Name of podcast to look up", type=str)
+    args = parser.parse_args()
+
+    if args.import_csv:
+        if not valid_existing_file(args.import_csv, ".csv"):
+            exit(1)
+        count = import_csv(args.import_csv)
+        print(f"Imported {count} shows from {args.import_csv}")
+    if args.name:
+        print(get_show(args.name))
+
+
+def get_connection(filepath=REGISTRY_FILE):
+    """
+    Open registry database once per process and create table if needed,
+    a new registry is seeded from existing CSV file of Spotify show IDs
+    """
+    global _connection
+    with registry_lock:
+        if _connection is None:
+            Path(os.path.dirname(filepath)).mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(filepath, timeout=30, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS shows (
+                    name_key TEXT PRIMARY KEY,
+                    name TEXT,
+                    itunes_id INTEGER,
+                    spotify_id TEXT,
+                    google_id TEXT,
+                    created INTEGER,
+                    updated INTEGER
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS shows_itunes_id ON shows (itunes_id)")
+            connection.execute("CREATE INDEX IF NOT EXISTS shows_spotify_id ON shows (spotify_id)")
+            connection.commit()
+            _connection = connection
+            is_empty = connection.execute("SELECT COUNT(*) FROM shows").fetchone()[0] == 0
+            if is_empty and os.path.isfile(SHOWS_CSV_FILE):
+                import_csv(SHOWS_CSV_FILE)
+    return _connection
+
+
+def normalize_name(name):
+    """ Normalize podcast name by lowering case, removing punctuation and extra spaces """
+    if not isinstance(name, str):
+        return None
+    name = name.casefold().translate(str.maketrans('', '', string.punctuation))
+    return " ".join(name.split())
+
+
+def get_show(name=None, itunes_id=None):
+    """
+    Returns stored IDs for show with given name or iTunes ID as dict
+    or None if show is not in registry
+    """
+    connection = get_connection()
+    if itunes_id:
+        row = connection.execute(
+            "SELECT * FROM shows WHERE itunes_id = ?", (int(itunes_id),)).fetchone()
+        if row:
+            return dict(row)
+    name_key = normalize_name(name)
+    if not name_key:
+        return None
+    row = connection.execute(
+        "SELECT * FROM shows WHERE name_key = ?", (name_key,)).fetchone()
+    return dict(row) if row else None
+
+
+def store_show(name, itunes_id=None, spotify_id=None, google_id=None, commit=True):
+    """
+    Inserts show or updates IDs of existing show,
+    IDs that are not given are left unchanged
+    """
+    name_key = normalize_name(name)
+    if not name_key:
+        raise Exception(f"store_show: Invalid podcast name {name}")
+    now = timestamp_ms()
+    with registry_lock:
+        connection = get_connection()
+        connection.execute("""
+            INSERT INTO shows (name_key, name, itunes_id, spotify_id, google_id, created, updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(name_key) DO UPDATE SET
+                itunes_id = COALESCE(excluded.itunes_id, itunes_id),
+                spotify_id = COALESCE(excluded.spotify_id, spotify_id),
+                google_id = COALESCE(excluded.google_id, google_id),
+                updated = excluded.updated
+        """, (
+            name_key,
+            name.strip(),
+            int(itunes_id) if itunes_id else None,
+            spotify_id,
+            google_id,
+            now,
+            now
+        ))
+        if commit:
+            connection.commit()
+
+
+def import_csv(filepath=SHOWS_CSV_FILE):
+    """ Imports rows of CSV file with columns `name` and `id` (Spotify ID) """
+    count = 0
+    with open(filepath) as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            if not row.get('name') or not row.get('id'):
+                continue
+            store_show(row['name'], spotify_id=row['id'].strip(), commit=False)
+            count += 1
+    get_connection().commit()
+    return count
+
+
+if __name__=="__main__":
+    main()
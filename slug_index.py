@@ -0,0 +1,64 @@
+"""
+Index of slugs already used by items, loaded once per run from MongoDB
+or from JSON output files. Slugs of new items are made unique in memory
+by adding a number (`episode-1`, `episode-1-2`, ...) instead of checking
+database for each item, new slugs are saved in bulk with items of run
+"""
+
+import os
+import glob
+import threading
+from common import load_existing_json_file
+from transform_for_db import slugify
+
+
+class SlugIndex:
+    """ Allocates slugs that are not used by existing items or earlier items of run """
+
+    def __init__(self, slugs=()):
+        self.slugs = set(slug for slug in slugs if slug)
+        # Next number to try for each base slug, so repeated titles are not rescanned
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_mongo(cls, collection):
+        """ Index of slugs of all items in MongoDB collection """
+        cursor = collection.find({'slug': {'$exists': True}}, {'slug': 1, '_id': 0})
+        return cls(item.get('slug') for item in cursor)
+
+    @classmethod
+    def from_files(cls, paths=(), exclude=()):
+        """ Index of slugs of items in JSON files (paths or glob patterns) except `exclude` """
+        slugs = set()
+        exclude = set(os.path.abspath(filepath) for filepath in exclude)
+        for pattern in paths:
+            for filepath in glob.glob(pattern, recursive=True):
+                if os.path.abspath(filepath) in exclude:
+                    continue
+                items = load_existing_json_file(None, None, filepath)
+                if isinstance(items, list):
+                    slugs.update(item.get('slug') for item in items if isinstance(item, dict))
+        return cls(slugs)
+
+    def allocate(self, slug):
+        """ Returns `slug`, or `slug` with first free number if it is already used """
+        if not slug:
+            return slug
+        with self.lock:
+            unique = slug
+            if unique in self.slugs:
+                n = self.counters.get(slug, 2)
+                while f"{slug}-{n}" in self.slugs:
+                    n += 1
+                unique = f"{slug}-{n}"
+                self.counters[slug] = n + 1
+            self.slugs.add(unique)
+            return unique
+
+    def assign(self, db_items):
+        """ Gives each item a unique slug based on its slug or title """
+        for db_item in db_items:
+            slug = db_item.get('slug') or (slugify(db_item['title']) if db_item.get('title') else "")
+            db_item['slug'] = self.allocate(slug)
+        return db_items
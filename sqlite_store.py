@@ -0,0 +1,95 @@
+"""
+Helpers for local stores in SQLite
+`TTLCache` keeps JSON values of upstream responses by key until they expire,
+and records keys that could not be found with a shorter TTL
+`select_in` queries rows matching many values in chunks
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from common import timestamp_ms
+
+DAY_MS = 24 * 60 * 60 * 1000
+# Stay below SQLite's limit of variables per query
+MAX_VARIABLES = 500
+
+
+def select_in(connection, query, values, args=()):
+    """
+    Rows of `query` for all `values`, requested in chunks
+    `query` has `{}` in place of placeholders of `IN ({})`, `args` are parameters before them
+    """
+    values = list(values)
+    rows = []
+    for i in range(0, len(values), MAX_VARIABLES):
+        chunk = values[i:i + MAX_VARIABLES]
+        rows.extend(connection.execute(
+            query.format(",".join("?" * len(chunk))), list(args) + chunk).fetchall())
+    return rows
+
+
+class TTLCache:
+    """ Table of JSON values by key that expire after `ttl_days`, database is opened on first use """
+
+    def __init__(self, filepath, table, ttl_days=30, negative_ttl_days=1, key_column="key"):
+        self.filepath = filepath
+        self.table = table
+        self.ttl_days = ttl_days
+        self.negative_ttl_days = negative_ttl_days
+        self.key_column = key_column
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def connection(self):
+        """ Open database once per process and create table if needed """
+        with self._lock:
+            if self._connection is None:
+                Path(os.path.dirname(self.filepath)).mkdir(parents=True, exist_ok=True)
+                connection = sqlite3.connect(self.filepath, timeout=30, check_same_thread=False)
+                connection.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.table} (
+                        {self.key_column} TEXT PRIMARY KEY,
+                        data TEXT,
+                        status INTEGER,
+                        expires INTEGER
+                    )
+                """)
+                connection.commit()
+                self._connection = connection
+        return self._connection
+
+    def get(self, key):
+        """ Returns cached value, empty dict if key is known to be missing or None if not cached or expired """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        Returns dict of key -> cached value, or empty dict if key is known to be missing,
+        keys that are not cached or have expired are left out
+        """
+        rows = select_in(
+            self.connection(),
+            f"SELECT {self.key_column}, data, status FROM {self.table} WHERE expires > ? AND {self.key_column} IN ({{}})",
+            keys, [timestamp_ms()])
+        # New empty dict for each missing key, so callers cannot change a shared value
+        return {key: json.loads(data) if status == 200 else {} for key, data, status in rows}
+
+    def store(self, keys, value):
+        """ Stores value under each of `keys` """
+        self._store(keys, json.dumps(value), 200, self.ttl_days)
+
+    def store_not_found(self, keys, status):
+        """ Records that value of `keys` could not be found (HTTP `status`) """
+        self._store(keys, None, status, self.negative_ttl_days)
+
+    def _store(self, keys, data, status, ttl_days):
+        expires = timestamp_ms() + ttl_days * DAY_MS
+        connection = self.connection()
+        with self._lock:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO {self.table} ({self.key_column}, data, status, expires) VALUES (?, ?, ?, ?)",
+                [(key, data, status, expires) for key in keys])
+            connection.commit()
@@ -0,0 +1,117 @@
+"""
+Index of TED talks stored in SQLite, built from `db/ted_db.json`
+(dict of YouTube URL -> talk with ted.com `url`, `title`, `description`,
+`speaker`, `length` and `publishdate`)
+Talks are looked up by YouTube URL or ted.com slug, database is opened
+on first lookup instead of loading whole JSON file at import
+
+To rebuild index from JSON file:
+    python3 ted_db.py --rebuild db/ted_db.json
+"""
+
+import os
+import json
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+from sys import exit
+from common import valid_existing_file
+from sqlite_store import select_in
+
+INDEX_FILE = os.path.join("db", "ted_db.db")
+TED_JSON_FILE = os.path.join("db", "ted_db.json")
+
+_connection = None
+_lock = threading.RLock()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rebuild", help="Path to JSON file of TED talks keyed by YouTube URL", nargs="?", const=TED_JSON_FILE, default=None)
+    parser.add_argument("-u", "--url", help="YouTube URL of talk to look up", type=str)
+    parser.add_argument("-s", "--slug", help="ted.com slug of talk to look up", type=str)
+    args = parser.parse_args()
+
+    if args.rebuild:
+        if not valid_existing_file(args.rebuild, ".json"):
+            exit(1)
+        count = rebuild(args.rebuild)
+        print(f"Indexed {count} TED talks from {args.rebuild}")
+    if args.url:
+        print(get_talk(args.url))
+    if args.slug:
+        print(get_talk_by_slug(args.slug))
+
+
+def get_connection(filepath=INDEX_FILE):
+    """
+    Open index database once per process and create table if needed,
+    a new index is built from existing JSON file of TED talks
+    """
+    global _connection
+    with _lock:
+        if _connection is None:
+            Path(os.path.dirname(filepath)).mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(filepath, timeout=30, check_same_thread=False)
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS talks (
+                    youtube_url TEXT PRIMARY KEY,
+                    slug TEXT,
+                    data TEXT
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS talks_slug ON talks (slug)")
+            connection.commit()
+            _connection = connection
+            is_empty = connection.execute("SELECT COUNT(*) FROM talks").fetchone()[0] == 0
+            if is_empty and os.path.isfile(TED_JSON_FILE):
+                rebuild(TED_JSON_FILE)
+    return _connection
+
+
+def talk_slug(url):
+    """ Slug of talk from its ted.com URL """
+    if not url:
+        return None
+    return url.rstrip("/").rsplit("/", maxsplit=1)[-1]
+
+
+def get_talk(youtube_url):
+    """ Returns talk with given YouTube URL as dict or None if talk is not indexed """
+    row = get_connection().execute(
+        "SELECT data FROM talks WHERE youtube_url = ?", (youtube_url,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def get_talk_by_slug(slug):
+    """ Returns talk with given ted.com slug as dict or None if talk is not indexed """
+    row = get_connection().execute(
+        "SELECT data FROM talks WHERE slug = ?", (slug,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def get_talks(youtube_urls):
+    """ Returns dict of YouTube URL -> talk for given URLs that are indexed """
+    rows = select_in(get_connection(), "SELECT youtube_url, data FROM talks WHERE youtube_url IN ({})", set(youtube_urls))
+    return {youtube_url: json.loads(data) for youtube_url, data in rows}
+
+
+def rebuild(filepath=TED_JSON_FILE):
+    """ Replaces indexed talks with talks in JSON file, returns count of talks """
+    with open(filepath, "r") as f:
+        ted_db = json.load(f)
+    rows = [
+        (youtube_url, talk_slug(talk.get('url')), json.dumps(talk))
+        for youtube_url, talk in ted_db.items()
+    ]
+    with _lock:
+        connection = get_connection()
+        connection.execute("DELETE FROM talks")
+        connection.executemany("INSERT OR REPLACE INTO talks (youtube_url, slug, data) VALUES (?, ?, ?)", rows)
+        connection.commit()
+    return len(rows)
+
+
+if __name__=="__main__":
+    main()
@@ -1,8 +1,10 @@
-from videos import search_youtube_channel
+from videos import search_youtube_channel_ids, youtube_videos_stats, get_channel_details
 from transform_for_db import transform_youtube, transform_tedtalks
 import logging
-from common import load_existing_json_file
+import ted_db
+import youtube_quota
 from python_graphql_client import GraphqlClient
+from concurrent.futures import ThreadPoolExecutor
 import pprint
 
 pp = pprint.PrettyPrinter(depth=6)
@@ -12,37 +14,85 @@ logger = logging.getLogger('ted-log')
 CHANNEL_TED = "UCAuUUnT6oDeKwE6v1NGQxug"
 CHANNEL_TEDED = "UCsooa4yRKGN_zEE8iknghZA"
 CHANNEL_TEDX = "UCsT0YIqwnpJCM-mx7-gSA4Q"
-TED_DB = load_existing_json_file(folder="db", name="ted_db")
+# Talks resolved per GraphQL request and concurrent requests for larger sets
+TED_BATCH_SIZE = 25
+TED_MAX_WORKERS = 4
+VIDEO_FIELDS = """
+                slug
+                id
+                title
+                playerData
+                description
+                curatorApproved
+                audioDownload
+                duration
+                audioInternalLanguageCode
+                hasTranslations
+                publishedAt
+                videoContext
+                recordedOn
+                language
+                viewedCount
+"""
+
+ted_client = GraphqlClient(endpoint="https://graphql.ted.com/")
 
 
-def ted_youtube_search_and_transform(search_term, limit=10, include_tedx=True):
+def ted_channels(include_tedx=True, include_teded=False):
+    channels = [CHANNEL_TED]
+    if include_tedx:
+        channels.append(CHANNEL_TEDX)
+    if include_teded:
+        channels.append(CHANNEL_TEDED)
+    return channels
+
+
+def ted_video_counts(include_tedx=True, include_teded=False):
+    """ Count of videos of each TED channel searched, costs 1 YouTube quota unit per channel once per run """
+    return [get_channel_details(channelId)[1] for channelId in ted_channels(include_tedx, include_teded)]
+
+
+def ted_youtube_search_and_transform(search_term, limit=10, include_tedx=True, include_teded=False):
     # Initialise variables
-    search_results = []
     db_items = []
-    
-    # Search for videos in TED's channels on Youtube
-    if include_tedx:
-        limit = limit // 2
-    ted = search_youtube_channel(
-        search_term=search_term, 
-        channelId=CHANNEL_TED, 
-        limit=limit)
-    # pp.pprint(ted)
-    search_results.extend(ted)
-    if include_tedx:
-        ted_ed = search_youtube_channel(
-            search_term=search_term, 
-            channelId=CHANNEL_TEDX, 
-            limit=limit)
-        search_results.extend(ted_ed)
-    # pp.pprint(ted_ed)
-    # Transform each result
+    channels = ted_channels(include_tedx, include_teded)
+
+    # Search for videos in TED's channels on Youtube at the same time,
+    # each channel is searched for its share of `limit` results, at least a full first page
+    # as a search page costs the same for any number of results up to 50
+    channel_limit = youtube_quota.channel_search_limit(limit, len(channels))
+    with ThreadPoolExecutor(max_workers=len(channels)) as executor:
+        channel_ids = list(executor.map(
+            lambda channelId: search_youtube_channel_ids(
+                search_term=search_term,
+                channelId=channelId,
+                limit=channel_limit),
+            channels))
+
+    # Merge results of channels by rank and get details of best `limit` videos at once
+    search_results = youtube_videos_stats(merge_by_rank(channel_ids)[:limit])
+
+    # Find talks of results in TED database and get details of all talks at once
+    youtube_items = []
     for result in search_results:
         try:
             item = transform_youtube(result, search_term, type="tedtalks")
+        except Exception as e:
+            logger.warning(f"Transform error: {e}")
+        else:
+            if item:
+                youtube_items.append(item)
+    ted_items = ted_db.get_talks([item['metadata']['url'] for item in youtube_items])
+    tedtalks = get_tedtalks([ted_item['url'] for ted_item in ted_items.values()])
+
+    # Transform each result
+    for item in youtube_items:
+        try:
             youtube_url = item['metadata']['url']
-            ted_item = TED_DB[youtube_url]
-            tedtalk = get_tedtalk(ted_item['url'])
+            ted_item = ted_items.get(youtube_url)
+            if not ted_item:
+                raise Exception(f"{youtube_url} not found in TED database")
+            tedtalk = tedtalks.get(ted_db.talk_slug(ted_item['url']))
             if tedtalk:
                 item = transform_tedtalks(tedtalk, search_term)
             else:
@@ -61,37 +111,67 @@ def ted_youtube_search_and_transform(search_term, limit=10, include_tedx=True):
     
     return db_items[:limit]
 
+def merge_by_rank(ranked_lists):
+    """ Interleaves lists by rank (first of each list, then second...) without duplicates """
+    merged = []
+    for rank in range(max(map(len, ranked_lists), default=0)):
+        for ranked in ranked_lists:
+            if rank < len(ranked) and ranked[rank] not in merged:
+                merged.append(ranked[rank])
+    return merged
+
+
 def get_tedtalk(url):
-    talk_id = url.rstrip("/").rsplit("/", maxsplit=1)
-    slug = talk_id[-1]
-    client = GraphqlClient(endpoint="https://graphql.ted.com/")
-    
+    slug = ted_db.talk_slug(url)
+    return get_tedtalks([url]).get(slug)
+
+
+def get_tedtalks(urls, batch_size=TED_BATCH_SIZE):
+    """
+    Get details of TED talks with given ted.com URLs
+    and return dict of slug -> `{'video': ...}`, talks that are not found are left out
+    Each request resolves a batch of talks using aliases (`v0: video(slug: ...)`),
+    batches are requested concurrently
+    """
+    slugs = list(dict.fromkeys(slug for slug in map(ted_db.talk_slug, urls) if slug))
+    batches = [slugs[i:i + batch_size] for i in range(0, len(slugs), batch_size)]
+    if not batches:
+        return {}
+
+    def get_batch(batch):
+        try:
+            return get_tedtalks_batch(batch)
+        except Exception as e:
+            logger.warning(f"Unable to get TED talks {batch}: {e}")
+            return {}
+
+    tedtalks = {}
+    with ThreadPoolExecutor(max_workers=min(TED_MAX_WORKERS, len(batches))) as executor:
+        for batch_talks in executor.map(get_batch, batches):
+            tedtalks.update(batch_talks)
+    return tedtalks
+
+
+def get_tedtalks_batch(slugs):
+    """ Get details of TED talks with given slugs in one GraphQL request """
     # Defined query and variables
-    query = """
-        query videoQuery($videoslug: String) {
-            video(slug:$videoslug) {
-                slug
-                id
-                title
-                playerData
-                description
-                curatorApproved
-                audioDownload
-                duration
-                audioInternalLanguageCode
-                hasTranslations
-                publishedAt
-                videoContext
-                recordedOn
-                language
-                viewedCount
-            }
-        }
+    variables = {f"s{i}": slug for i, slug in enumerate(slugs)}
+    definitions = ", ".join(f"${name}: String" for name in variables)
+    aliases = "".join(
+        f"""
+            v{i}: video(slug: $s{i}) {{{VIDEO_FIELDS}            }}"""
+        for i in range(len(slugs))
+    )
+    query = f"""
+        query videosQuery({definitions}) {{{aliases}
+        }}
     """
-    variables = {"videoslug": slug}
 
-    result = client.execute(query=query, variables=variables)
-    data = result.get('data', {})
-    if data.get('video'):
-        return data
-    return None
\ No newline at end of file
+    result = ted_client.execute(query=query, variables=variables)
+    data = result.get('data') or {}
+    tedtalks = {}
+    for i, slug in enumerate(slugs):
+        video = data.get(f"v{i}")
+        if video:
+            tedtalks[slug] = {'video': video}
+    return tedtalks
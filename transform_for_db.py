@@ -238,6 +238,7 @@ def add_itunes_data(db_item, itunes_episode, metadata=None):
     db_item['metadata']['audio_file'] = itunes_episode.get('episodeUrl', db_item['metadata']['audio_file'])
     db_item['original'].append(itunes_episode)  
     db_item['score'] = calculate_score_podcast(db_item)          
+    return db_item
 
 
 def transform_book(item, search_term):
@@ -309,15 +310,24 @@ def transform_scopus(item, search_term=None):
     try:
         db_item = _db_item(media_type="article", tags="research")
 
+        # Abstract and all authors are only in search results of `COMPLETE` view
+        description = item.get('dc:description') or ""
+        authors = [author.get('authname') for author in item.get('author', []) if author.get('authname')]
+        if item.get('pii'):
+            url = "https://www.sciencedirect.com/science/article/pii/" + item['pii']
+        else:
+            url = next(link['@href'] for link in item.get("link", []) if link['@ref'] == "scopus")
+
         db_item['title'] = item['dc:title']
-        db_item['description'] = None
-        db_item['authors'] = [item.get('dc:creator')]
-        db_item['metadata']['url'] = next(link['@href'] for link in item.get("link", []) if link['@ref'] == "scopus")
+        db_item['description'] = clean_html(description.strip()) or None
+        db_item['authors'] = authors or [item.get('dc:creator')]
+        db_item['metadata']['url'] = url
         db_item['metadata']['tag'] = [search_term.strip().lower()] if isinstance(search_term, str) else []
         db_item['metadata']['id'] = item['pii']
         db_item['metadata']['citations'] = ""
         db_item['original'] = [item]
         db_item['publishedDate'] = standard_date(item.get('prism:coverDate'))
+        db_item['slug'] = slugify(db_item['title']) 
     
     except Exception as e:
         print(e.__class__.__name__, e)
@@ -362,16 +372,26 @@ def transform_pubmed(data, search_term=None):
         pub_date_dict = next((item for item in date_list if item['@PubStatus'] == "pubmed"), {})
         pub_date = datetime.date(
             year=int(pub_date_dict['Year']), 
-            month=int(pub_date_dict.get('Month', 0)),
-            day=int(pub_date_dict.get('Day', 0)),
+            month=int(pub_date_dict.get('Month', 1)),
+            day=int(pub_date_dict.get('Day', 1)),
             ).isoformat()
         # Extract keywords
-        keywords = [
-            item["#text"] 
-            for item in medline.get('KeywordList', {}).get('Keyword', [])
-            ]
+        keyword_lists = medline.get('KeywordList', [])
+        keyword_lists = keyword_lists if isinstance(keyword_lists, list) else [keyword_lists]
+        keywords = []
+        for keyword_list in keyword_lists:
+            keyword_items = keyword_list.get('Keyword', [])
+            keyword_items = keyword_items if isinstance(keyword_items, list) else [keyword_items]
+            keywords.extend(
+                item.get("#text") if isinstance(item, dict) else item 
+                for item in keyword_items
+                )
+        # Title has its own tags if it includes formatting
+        title = article['ArticleTitle']
+        if isinstance(title, dict):
+            title = title.get("#text", "")
 
-        db_item['title'] = clean_html(article['ArticleTitle'])
+        db_item['title'] = clean_html(title)
         db_item['description'] = clean_html(description)
         db_item['authors'] = authors
         db_item['metadata']['url'] = "https://pubmed.ncbi.nlm.nih.gov/" + medline['PMID']['#text']
@@ -398,8 +418,13 @@ def transform_scd(data, search_term=None):
         creators = coredata.get('dc:creator', [])
         if isinstance(creators, dict):
             creators = [creators]
-        url = next((link['@href'] for link in coredata.get("link", []) 
+        links = coredata.get("link", [])
+        if isinstance(links, dict):
+            links = [links]
+        url = next((link['@href'] for link in links 
                     if link['@rel'] == "scidir"), None)
+        if not url and coredata.get('pii'):
+            url = "https://www.sciencedirect.com/science/article/pii/" + coredata['pii']
 
         db_item['title'] = coredata['dc:title']
         description = coredata.get('dc:description', "") or ""
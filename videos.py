@@ -5,46 +5,71 @@ from urllib import parse
 from dotenv import load_dotenv, find_dotenv
 from transform_for_db import transform_youtube
 from progress import progress
+from common import paginate
+from concurrent.futures import ThreadPoolExecutor
+import youtube_quota
+import threading
 import pprint
 
 # Get API key from .env
 load_dotenv(find_dotenv())
 API_KEY = os.getenv('YOUTUBE_API_KEY')
 MAX_RESULTS = 50
+MAX_WORKERS = 8
+# Only request fields used by `transform_youtube`
+VIDEO_FIELDS = (
+    "items(id,"
+    "snippet(title,description,channelTitle,publishedAt,"
+    "thumbnails(maxres/url,standard/url,high/url,medium/url,default/url)),"
+    "statistics)"
+)
+PLAYLIST_FIELDS = "nextPageToken,items/snippet(title,description,resourceId/videoId)"
 
 logger = logging.getLogger('videos-log')
 pp = pprint.PrettyPrinter(depth=6)
+# Uploads of channels listed in this run, channel ID -> list of playlist item snippets
+_uploads = {}
+# Lock of each channel, so that channels are listed at the same time but each only once
+_uploads_locks = {}
+_uploads_lock = threading.Lock()
+# Uploads playlist ID and count of videos of channels looked up in this run
+_channels = {}
 
-def get_youtube(payload, verbose=False, url_path="search"):
+def get_youtube(payload, verbose=False, url_path="search", limit=None, keep=None, raise_errors=False):
     """ 
     Generator that makes GET request to YouTube Data API v3 with given payload
     https://developers.google.com/youtube/v3/docs/search/list
     and yields list of title and url, iterates over paged results
+    Next page is prefetched while current page is used, at most `limit` results
+    that pass filter `keep` are yielded
+    A failed request ends results, or raises exception if `raise_errors`
     """
 
     url = "https://www.googleapis.com/youtube/v3/" + url_path
-    n = 1
-    while True:
+
+    def fetch_page(page_token, size):
+        page_payload = dict(payload)
+        if page_token:
+            page_payload['pageToken'] = page_token
+        if 'maxResults' in page_payload:
+            page_payload['maxResults'] = size
         # Make request
-        payload_str = parse.urlencode(payload, safe=':+')
+        payload_str = parse.urlencode(page_payload, safe=':+')
         try:
-            # if verbose: print("Getting page ", n)
+            youtube_quota.charge(url_path)
             response = requests.get(url, params=payload_str)
             response.raise_for_status()
         except requests.RequestException as e:
             if verbose: print(f"Unable to search YouTube for {payload}: {e}")
             logger.warning(f"Unable to search YouTube for {payload}: {e}")
-            break
-        # Parse response
+            if raise_errors:
+                raise
+            return [], None
+        # Parse response, get token for next page if it exists
         data = response.json()
-        results = [item for item in data['items']]
-        # Yield list of title and url
-        yield results
-        # Get token for next page if it exists, else stop
-        if "nextPageToken" not in data: 
-            break
-        payload['pageToken'] = data['nextPageToken']
-        n += 1
+        return data.get('items', []), data.get('nextPageToken')
+
+    return paginate(fetch_page, limit=limit, page_size=payload.get('maxResults', MAX_RESULTS), keep=keep)
      
 def search_youtube(search_term, limit=10, country="US", lang="en"):
     """ 
@@ -55,6 +80,12 @@ def search_youtube(search_term, limit=10, country="US", lang="en"):
     """
     #TODO: Check if country and language are valid
 
+    # Search has no cheaper alternative, skip if quota cannot cover it
+    if not youtube_quota.can_afford(youtube_quota.search_cost(limit)):
+        print(f"YouTube quota too low to search for {search_term}")
+        logger.warning(f"YouTube quota too low to search for {search_term}")
+        return []
+
     # Construct request URL
     payload = {
         "part": "snippet",
@@ -67,11 +98,8 @@ def search_youtube(search_term, limit=10, country="US", lang="en"):
     }
 
     results = []
-    youtube_results = get_youtube(payload)
-    for result in youtube_results:
+    for result in get_youtube(payload, limit=limit):
         results.extend(result)
-        if len(results) >= limit:
-            youtube_results.close()
     
     return results
 
@@ -95,9 +123,29 @@ def search_youtube_channel(search_term, channelId, limit=10, order="relevance",
     """ 
     Searches TED channel on YouTube for given search term
     and outputs list of title and url, default count of 10
+    When YouTube quota runs low, filters channel's uploads instead of searching
+    """
+    ids = search_youtube_channel_ids(search_term, channelId, limit, order, verbose)
+    statistics = youtube_videos_stats(ids, verbose=verbose)
+    
+    return statistics
+
+
+def search_youtube_channel_ids(search_term, channelId, limit=10, order="relevance", verbose=False):
+    """
+    Searches channel on YouTube for given search term and returns IDs of videos in order of rank
+    When YouTube quota runs low, filters channel's uploads instead of searching
     """
     #TODO: Check if country and language are valid
 
+    if youtube_quota.is_low(youtube_quota.search_cost(limit or MAX_RESULTS)):
+        # Listing uploads costs 1 unit per 50 videos once per run, large channels can cost more than searching
+        listing_cost = get_uploads_listing_cost(channelId, verbose)
+        if listing_cost is not None and youtube_quota.can_afford(listing_cost):
+            if verbose: print("YouTube quota is low, filtering uploads of channel", channelId)
+            return search_channel_uploads(search_term, channelId, limit, verbose)
+        if verbose: print("YouTube quota is low, cannot afford listing uploads of channel", channelId)
+
     # Construct request URL
     payload = {
         "part": "snippet",
@@ -110,37 +158,144 @@ def search_youtube_channel(search_term, channelId, limit=10, order="relevance",
     }
 
     results = []
-    youtube_results = get_youtube(payload, verbose)
-    for result in youtube_results:
+    for result in get_youtube(payload, verbose, limit=limit):
         results.extend(result)
-        if limit and len(results) >= limit:
-            youtube_results.close()
 
-    ids = [result['id']['videoId'] for result in results]
-    statistics = youtube_videos_stats(ids, verbose=verbose)
-    
-    return statistics
+    return [result['id']['videoId'] for result in results]
 
 
-def youtube_videos_stats(ids, verbose=False, part="snippet,statistics"):
+def get_channel_details(channelId, verbose=False):
+    """ Get ID of playlist of all uploads of channel and count of its videos (None if unknown), once per run """
+    if channelId not in _channels:
+        payload = {
+            "part": "contentDetails,statistics",
+            "id": channelId,
+            "key": API_KEY,
+            "fields": "items(contentDetails/relatedPlaylists/uploads,statistics/videoCount)",
+        }
+        # Uploads playlist ID is derived from channel ID
+        details = ("UU" + channelId[2:], None)
+        for result in get_youtube(payload, verbose=verbose, url_path="channels"):
+            for item in result:
+                details = (
+                    item['contentDetails']['relatedPlaylists']['uploads'],
+                    int(item.get('statistics', {}).get('videoCount', 0)) or None,
+                )
+        _channels[channelId] = details
+    return _channels[channelId]
+
+
+def get_uploads_playlist(channelId, verbose=False):
+    """ Get ID of playlist of all uploads of channel """
+    return get_channel_details(channelId, verbose)[0]
+
+
+def get_uploads_listing_cost(channelId, verbose=False):
+    """ Units for listing uploads of channel, 0 if already listed in this run, None if count of videos is unknown """
+    if channelId in _uploads:
+        return 0
+    video_count = get_channel_details(channelId, verbose)[1]
+    return youtube_quota.listing_cost(video_count) if video_count else None
+
+
+def get_channel(channelId, verbose=False):
+    """ Get title of channel and ID of playlist of all uploads of channel """
+    payload = {
+        "part": "snippet,contentDetails",
+        "id": channelId,
+        "key": API_KEY,
+        "fields": "items(snippet/title,contentDetails/relatedPlaylists/uploads)",
+    }
+    for result in get_youtube(payload, verbose=verbose, url_path="channels"):
+        for item in result:
+            return item['snippet']['title'], item['contentDetails']['relatedPlaylists']['uploads']
+    raise Exception(f"get_channel: YouTube channel {channelId} not found")
+
+
+def get_playlist_items(playlist_id, verbose=False, fields=PLAYLIST_FIELDS, raise_errors=False):
+    """ 
+    Generator that yields pages of items of playlist, newest first for uploads playlist,
+    costs 1 quota unit per 50 items
+    """
+    payload = {
+        "part": "snippet",
+        "playlistId": playlist_id,
+        "key": API_KEY,
+        "maxResults": MAX_RESULTS,
+    }
+    if fields:
+        payload['fields'] = fields
+    yield from get_youtube(payload, verbose=verbose, url_path="playlistItems", raise_errors=raise_errors)
+
+
+def get_channel_uploads(channelId, verbose=False):
+    """
+    List snippets of all uploads of channel once per run,
+    if listing fails partway uploads listed so far are returned but not kept
+    """
+    with _uploads_lock:
+        channel_lock = _uploads_locks.setdefault(channelId, threading.Lock())
+    with channel_lock:
+        if channelId in _uploads:
+            return _uploads[channelId]
+        uploads = []
+        try:
+            for items in get_playlist_items(get_uploads_playlist(channelId, verbose), verbose, raise_errors=True):
+                uploads.extend(item['snippet'] for item in items)
+        except requests.RequestException:
+            return uploads
+        _uploads[channelId] = uploads
+        return uploads
+
+
+def search_channel_uploads(search_term, channelId, limit=10, verbose=False):
+    """
+    Returns IDs of channel's uploads whose title or description contain all words in `search_term`,
+    newest first. Costs 1 quota unit per 50 uploads once per run instead of 100 units per search
+    """
+    words = search_term.casefold().split()
+    ids = []
+    for snippet in get_channel_uploads(channelId, verbose):
+        text = (snippet.get('title', "") + " " + snippet.get('description', "")).casefold()
+        if all(word in text for word in words):
+            ids.append(snippet['resourceId']['videoId'])
+            if limit and len(ids) >= limit:
+                break
+    return ids
+
+
+def youtube_videos_stats(ids, verbose=False, part="snippet,statistics", fields=VIDEO_FIELDS):
+    """
+    Get details of videos with given IDs, requests chunks of 50 IDs concurrently
+    and returns results in order of chunks
+    `fields` restricts response to fields used by `transform_youtube`, pass None for full response
+    """
     
     if isinstance(ids, str):
         ids = [ids]
 
-    results = []
-    
-    for i in range(0, len(ids), MAX_RESULTS):
-        id_chunks = ids[i:i + MAX_RESULTS]
-            
+    chunks = [ids[i:i + MAX_RESULTS] for i in range(0, len(ids), MAX_RESULTS)]
+    if not chunks:
+        return []
+
+    def get_chunk(id_chunk):
         # Construct request URL
         payload = {
             "part": part,
-            "id": ",".join(id_chunks) ,
+            "id": ",".join(id_chunk) ,
             "maxResults": MAX_RESULTS,
             "key": API_KEY,
         }
-        youtube_results = get_youtube(payload, verbose=verbose, url_path="videos")
-        for result in youtube_results:
-            results.extend(result)
+        if fields:
+            payload['fields'] = fields
+        chunk_results = []
+        for result in get_youtube(payload, verbose=verbose, url_path="videos"):
+            chunk_results.extend(result)
+        return chunk_results
+
+    results = []
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(chunks))) as executor:
+        for chunk_results in executor.map(get_chunk, chunks):
+            results.extend(chunk_results)
     
-    return results
\ No newline at end of file
+    return results
@@ -1,16 +1,21 @@
 from sys import exit
+import os
 import argparse
-from videos import search_youtube_channel
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from videos import search_youtube_channel, get_channel, get_playlist_items, youtube_videos_stats, MAX_RESULTS, MAX_WORKERS
 from transform_for_db import transform_youtube
 import logging
 from progress import progress
-from common import create_json_file, load_existing_json_file, valid_destination
+from common import create_json_file, load_existing_json_file, valid_destination, get_valid_filename, JsonListWriter
 import pprint
 
 logger = logging.getLogger('videos-log')
 
 pp = pprint.PrettyPrinter(depth=6)  
 # channel = "UCUgZq9PkDp1xaEivtcfJPSg"
+# Only video IDs are needed from uploads playlist
+HARVEST_FIELDS = "nextPageToken,items/snippet/resourceId/videoId"
 
 def main():
     parser = argparse.ArgumentParser()
@@ -18,11 +23,32 @@ def main():
     parser.add_argument("channel", help="ID of channel", type=str)
     parser.add_argument("-v", "--verbose", help="Print results as they come", action="store_true")
     parser.add_argument("--limit", help="Update only first 10 items", type=int, default=0)
+    parser.add_argument("--harvest", help="List all uploads of channel from its uploads playlist (1 quota unit per 50 videos)", action="store_true")
+    parser.add_argument("-i", "--incremental", help="Harvest only videos newer than those in existing file", action="store_true")
     args = parser.parse_args()
 
     if not valid_destination(args.destination):
         exit(1)
 
+    # Videos between limit and existing file would be lost
+    if args.incremental and args.limit > 0:
+        print("--limit cannot be used with --incremental")
+        exit(1)
+
+    if args.harvest or args.incremental:
+        try:
+            count = harvest_channel_and_transform(
+                channel=args.channel,
+                destination=args.destination,
+                limit=None if args.limit <= 0 else args.limit,
+                incremental=args.incremental,
+                verbose=args.verbose)
+        except Exception as e:
+            print(e)
+            exit(1)
+        print(f"\nHarvested {count} new videos")
+        return
+
     videos = youtube_channel_and_transform(
         channel=args.channel, 
         limit=None if args.limit <= 0 else args.limit, 
@@ -56,5 +82,79 @@ def youtube_channel_and_transform(channel, limit=None, verbose=False):
     return db_items
 
 
+def harvest_channel_and_transform(channel, destination, limit=None, incremental=False, verbose=False):
+    """
+    Lists uploads of channel from its uploads playlist, newest first,
+    gets details of videos in concurrent chunks of 50 and writes items to
+    `<destination>/<channel title>.json` as they are transformed
+    If `incremental`, stops at newest video in existing file and keeps its items after new ones,
+    cannot be combined with `limit` as videos after limit would be missing from file
+    Returns number of new items
+    """
+    if incremental and limit:
+        raise Exception("harvest_channel_and_transform: `limit` cannot be used with `incremental`")
+    title, playlist_id = get_channel(channel, verbose)
+    filepath = os.path.join(destination, get_valid_filename(title) + ".json")
+    existing = []
+    stop_id = None
+    if incremental:
+        existing = load_existing_json_file(None, None, filepath) or []
+        stop_id = existing[0]['metadata']['id'] if existing else None
+        if verbose: print("Harvesting videos of", title, "newer than", stop_id)
+
+    def write_results(results, writer):
+        for result in results:
+            try:
+                item = transform_youtube(result, search_term=None)
+            except Exception as e:
+                if verbose: print(f"Transform error: {e}")
+                logger.warning(f"Transform error: {e}")
+            else:
+                if not item:
+                    continue
+                writer.write(item)
+                if verbose and limit: progress(writer.count, limit)
+
+    # Details of chunks are requested while next pages of playlist are listed,
+    # results are written in order of playlist
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, JsonListWriter(filepath) as writer:
+        for chunk in uploads_id_chunks(playlist_id, stop_id, limit, verbose):
+            pending.append(executor.submit(youtube_videos_stats, chunk, verbose))
+            while len(pending) > MAX_WORKERS or (pending and pending[0].done()):
+                write_results(pending.popleft().result(), writer)
+        while pending:
+            write_results(pending.popleft().result(), writer)
+        count = writer.count
+        for item in existing:
+            writer.write(item)
+
+    return count
+
+
+def uploads_id_chunks(playlist_id, stop_id=None, limit=None, verbose=False):
+    """
+    Generator that yields chunks of up to 50 video IDs of playlist,
+    stops at video with `stop_id` or after `limit` videos
+    """
+    chunk = []
+    count = 0
+    for items in get_playlist_items(playlist_id, verbose, fields=HARVEST_FIELDS):
+        for item in items:
+            video_id = item['snippet']['resourceId']['videoId']
+            if video_id == stop_id:
+                if chunk: yield chunk
+                return
+            chunk.append(video_id)
+            count += 1
+            if limit and count >= limit:
+                yield chunk
+                return
+            if len(chunk) == MAX_RESULTS:
+                yield chunk
+                chunk = []
+    if chunk: yield chunk
+
+
 if __name__=="__main__":
     main()
\ No newline at end of file
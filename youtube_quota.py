@@ -0,0 +1,159 @@
+"""
+Ledger of YouTube Data API quota units used per day, stored in `db/youtube_quota.json`
+https://developers.google.com/youtube/v3/determine_quota_cost
+Quota resets at midnight Pacific Time
+
+To predict units used by searching for terms in text file:
+    python3 youtube_quota.py <file-path> --limit <n>
+"""
+
+import os
+import json
+import math
+import argparse
+import threading
+from datetime import datetime
+from pathlib import Path
+from zoneinfo import ZoneInfo
+from sys import exit
+from dotenv import load_dotenv, find_dotenv
+from common import get_search_list
+
+# Get quota settings from .env
+load_dotenv(find_dotenv())
+LEDGER_FILE = os.path.join("db", "youtube_quota.json")
+DAILY_QUOTA = int(os.getenv('YOUTUBE_DAILY_QUOTA') or 10000)
+# Below this many remaining units, cheaper strategies are used instead of search
+LOW_QUOTA = int(os.getenv('YOUTUBE_LOW_QUOTA') or 2000)
+UNIT_COSTS = {
+    "search": 100,
+    "videos": 1,
+    "channels": 1,
+    "playlistItems": 1,
+}
+PAGE_SIZE = 50
+
+_lock = threading.Lock()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("search_file", help="Path of the text file containing search terms")
+    parser.add_argument("-l", "--limit", help="Total results", type=int, default=50)
+    args = parser.parse_args()
+
+    try:
+        search_list = get_search_list(args.search_file)
+    except Exception as e:
+        print(e)
+        exit(1)
+    print_plan(search_list, args.limit)
+
+
+def quota_day():
+    """ Current quota day in Pacific Time """
+    return datetime.now(ZoneInfo("America/Los_Angeles")).strftime("%Y-%m-%d")
+
+
+def _load_ledger():
+    """ Ledger of today, a fresh ledger if file is missing, from an earlier day or cannot be read """
+    today = quota_day()
+    if os.path.isfile(LEDGER_FILE):
+        try:
+            with open(LEDGER_FILE, "r") as f:
+                ledger = json.load(f)
+        except (OSError, ValueError):
+            ledger = None
+        if isinstance(ledger, dict) and ledger.get('date') == today:
+            return ledger
+    return {'date': today, 'used': 0, 'calls': {}}
+
+
+def charge(url_path, calls=1):
+    """ Charge units for `calls` requests to endpoint `url_path` and return units used today """
+    units = UNIT_COSTS.get(url_path, 1) * calls
+    with _lock:
+        ledger = _load_ledger()
+        ledger['used'] += units
+        ledger['calls'][url_path] = ledger['calls'].get(url_path, 0) + calls
+        Path(os.path.dirname(LEDGER_FILE)).mkdir(parents=True, exist_ok=True)
+        # Write to unique temporary file and replace ledger, so an interrupted write does not truncate it
+        temp_path = f"{LEDGER_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(ledger, f, indent=4)
+        os.replace(temp_path, LEDGER_FILE)
+    return ledger['used']
+
+
+def used():
+    with _lock:
+        return _load_ledger()['used']
+
+
+def remaining():
+    return max(DAILY_QUOTA - used(), 0)
+
+
+def can_afford(units):
+    return remaining() >= units
+
+
+def is_low(units=0):
+    """ Check if remaining units after spending `units` are below `LOW_QUOTA` """
+    return remaining() - units < LOW_QUOTA
+
+
+def search_cost(limit):
+    """ Units for a search of `limit` results and the stats of those videos """
+    pages = max(math.ceil(limit / PAGE_SIZE), 1)
+    return pages * UNIT_COSTS['search'] + pages * UNIT_COSTS['videos']
+
+
+def channel_search_limit(limit, channels):
+    """
+    Results searched in each of `channels` channels for `limit` results in total,
+    a share of `limit` but at least a full first page, which costs the same as fewer results
+    """
+    return max(math.ceil(limit / channels), min(limit, PAGE_SIZE))
+
+
+def listing_cost(video_count):
+    """ Units for listing all uploads of a channel with `video_count` videos """
+    return max(math.ceil(video_count / PAGE_SIZE), 1) * UNIT_COSTS['playlistItems']
+
+
+def plan_cost(search_list, limit, include_tedx=True, include_teded=False, video_counts=()):
+    """
+    Predict units used by YouTube and TED talks searches for each term in `search_list`,
+    `video_counts` are counts of videos of TED channels, whose uploads are listed once
+    instead of searched when quota runs low
+    """
+    ted_channels = 1 + include_tedx + include_teded
+    # Each TED channel is searched for its share of `limit` results,
+    # details of the `limit` best ranked results are requested together
+    ted_search = ted_channels * math.ceil(channel_search_limit(limit, ted_channels) / PAGE_SIZE) * UNIT_COSTS['search']
+    ted_stats = math.ceil(limit / PAGE_SIZE) * UNIT_COSTS['videos']
+    plan = {
+        'videos': len(search_list) * search_cost(limit),
+        'tedtalks': len(search_list) * (ted_search + ted_stats),
+    }
+    plan['total'] = plan['videos'] + plan['tedtalks']
+    plan['uploads'] = sum(listing_cost(count) for count in video_counts if count)
+    if is_low(plan['total']):
+        plan['total'] += plan['uploads']
+    return plan
+
+
+def print_plan(search_list, limit, video_counts=()):
+    """ Print predicted units of a run and whether they fit in remaining quota """
+    plan = plan_cost(search_list, limit, video_counts=video_counts)
+    left = remaining()
+    print(f"YouTube quota: {plan['total']} units planned ({plan['videos']} videos, {plan['tedtalks']} tedtalks), {left} of {DAILY_QUOTA} remaining")
+    if is_low(plan['total']):
+        listing = f"{plan['uploads']} units" if video_counts else "units unknown, see --plan-uploads"
+        print(f"YouTube quota will run low, channel searches will use uploads playlists where listing them is affordable ({listing})")
+    return plan
+
+
+if __name__=="__main__":
+    main()